@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+import argparse
+import collections
+import csv
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import random
+import resource
+import sys
+import tempfile
+import time
+
+import simplemr
+from cooccurrence import PairCoOccurrence, StripesCoOccurrence
+from mean import FifaMean
+from wordcount import WordCount, WordCountCombine
+
+CORPUS = 'mobydick.txt'
+FIFA_ROWS = 17_000  # rows of the synthetic FIFA dataset at scale 1 (about as many as in fifa21.csv)
+FIFA_CLUBS = 700
+RESULT_POLL_INTERVAL = 1.0  # seconds between checks that the process of run_in_process is still alive
+
+# job name -> (function creating the job, kind of input)
+JOBS = {
+    'WordCount': (WordCount, 'text'),
+    'WordCountCombine': (WordCountCombine, 'text'),
+    'FifaMean': (FifaMean, 'csv'),
+    'PairCoOccurrence': (lambda: PairCoOccurrence(4), 'text'),
+    'StripesCoOccurrence': (lambda: StripesCoOccurrence(4), 'text'),
+}
+
+
+def synthetic_corpus(path, scale, seed=42):
+    """Write a text corpus of `scale` times the size of CORPUS, made of its lines in random order."""
+    with open(CORPUS) as f:
+        lines = f.readlines()
+    rng = random.Random(seed)
+    with open(path, 'w') as f:
+        for _ in range(scale):
+            rng.shuffle(lines)
+            f.writelines(lines)
+
+
+def synthetic_fifa(path, scale, seed=42):
+    """Write a CSV file with the 'Club' and 'Overall' columns used by FifaMean."""
+    rng = random.Random(seed)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Name', 'Club', 'Overall'])
+        for i in range(FIFA_ROWS * scale):
+            writer.writerow([f'player{i}', f'club{rng.randrange(FIFA_CLUBS)}', rng.randint(45, 95)])
+
+
+def run_job(job_name, path, workers, result_queue):
+    """Run a job to completion in this (fresh) process, and put its measurements in result_queue."""
+    make_job, kind = JOBS[job_name]
+    job = make_job()
+    job.instrument = True
+    wall, cpu = time.perf_counter(), time.process_time()
+    with open(path, newline='' if kind == 'csv' else None) as f:
+        if kind == 'csv':
+            data = csv.DictReader(f)
+        elif workers is not None:
+            data = simplemr.MappedFile(path)  # workers read their own splits
+        else:
+            data = f
+        collections.deque(job.run(data, workers=workers), maxlen=0)  # consume the output
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    stats = job.stats.as_dict()
+    records = stats['phases']['input']['records_out']
+    size = os.path.getsize(path)
+    result_queue.put({
+        'wall_time': wall,
+        'cpu_time': cpu,  # of the driver only
+        'records': records,
+        'records_per_s': records / wall,
+        'mb_per_s': size / wall / 2 ** 20,
+        # ru_maxrss is in KiB on Linux; children are the worker processes (their maximum, not their sum)
+        'peak_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'peak_worker_rss_kib': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+        'stats': stats,
+    })
+
+
+class RunFailed(Exception):
+    pass
+
+
+def run_in_process(target, args):
+    """Call target(*args, result_queue) in a separate process, and return what it puts in result_queue.
+
+    If the process exits without a result (e.g., target raised), raise RunFailed rather than waiting forever.
+    """
+    result_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=target, args=(*args, result_queue))
+    process.start()
+    while True:
+        exited = process.exitcode is not None  # checked first: a result put before exiting is then in the queue
+        try:
+            result = result_queue.get(timeout=RESULT_POLL_INTERVAL)
+            break
+        except queue.Empty:
+            if exited:
+                raise RunFailed(f"exited with code {process.exitcode}") from None
+    process.join()
+    return result
+
+
+def benchmark(job_name, path, workers):
+    """Run a job in a separate process, so that peak memory usage is measured for that job alone."""
+    return run_in_process(run_job, (job_name, path, workers))
+
+
+def compare(results, baseline_path, threshold):
+    """Print the change in wall time with respect to a previous benchmark file, flagging regressions."""
+    with open(baseline_path) as f:
+        baseline = {(r['job'], r['scale'], r['workers']): r for r in json.load(f)['results']}
+    regressions = 0
+    for r in results:
+        old = baseline.get((r['job'], r['scale'], r['workers']))
+        if old is None:
+            continue
+        change = r['wall_time'] / old['wall_time'] - 1
+        flag = ''
+        if change > threshold:
+            flag = '  <-- REGRESSION'
+            regressions += 1
+        print(f"{r['job']:>20} x{r['scale']:<4} workers={r['workers']}: "
+              f"{old['wall_time']:8.3f}s -> {r['wall_time']:8.3f}s ({change:+.1%}){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--jobs', nargs='+', choices=JOBS, default=list(JOBS), help="jobs to run")
+    parser.add_argument('--scales', nargs='+', type=int, default=[1, 10], help="input sizes, in multiples of "
+                        f"{CORPUS} (or of {FIFA_ROWS} rows for FifaMean); e.g., 1 10 100")
+    parser.add_argument('--workers', nargs='+', type=int, default=[0, os.cpu_count()],
+                        help="worker processes to test; 0 means a serial run")
+    parser.add_argument('--output', default='benchmark.json', help="JSON file in which to store results")
+    parser.add_argument('--compare', help="JSON file of a previous run to compare with")
+    parser.add_argument('--threshold', type=float, default=0.1, help="slowdown reported as a regression")
+    parser.add_argument('--data-dir', help="where to write synthetic inputs (default: a temporary directory)")
+    args = parser.parse_args()
+
+    results, failures = [], 0
+    with tempfile.TemporaryDirectory(dir=args.data_dir) as data_dir:
+        for scale in args.scales:
+            inputs = {'text': os.path.join(data_dir, f'corpus-x{scale}.txt'),
+                      'csv': os.path.join(data_dir, f'fifa-x{scale}.csv')}
+            synthetic_corpus(inputs['text'], scale)
+            synthetic_fifa(inputs['csv'], scale)
+            for job_name in args.jobs:
+                for workers in args.workers:
+                    path = inputs[JOBS[job_name][1]]
+                    try:
+                        result = benchmark(job_name, path, workers or None)
+                    except RunFailed as e:
+                        print(f"{job_name:>20} x{scale:<4} workers={workers}: FAILED ({e})")
+                        failures += 1
+                        continue
+                    result.update(job=job_name, scale=scale, workers=workers, input_bytes=os.path.getsize(path))
+                    results.append(result)
+                    print(f"{job_name:>20} x{scale:<4} workers={workers}: {result['wall_time']:8.3f}s, "
+                          f"{result['records_per_s']:12,.0f} records/s, {result['mb_per_s']:7.2f} MB/s, "
+                          f"peak RSS {result['peak_rss_kib'] / 1024:7.1f} MiB")
+
+    with open(args.output, 'w') as f:
+        json.dump({'python': platform.python_version(), 'cpu_count': os.cpu_count(), 'results': results}, f,
+                  indent=2)
+
+    if args.compare is not None and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
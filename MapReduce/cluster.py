@@ -0,0 +1,493 @@
+#!/usr/bin/env python3
+
+import argparse
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
+from collections import namedtuple
+from multiprocessing.connection import Client, Listener
+from multiprocessing.managers import BaseManager
+
+import simplemr
+from wordcount import WordCountCombine
+
+try:
+    from kazoo.exceptions import NoNodeError, NodeExistsError
+except ImportError:  # we don't need kazoo with the fake registry
+    class NoNodeError(Exception):
+        pass
+
+    class NodeExistsError(Exception):
+        pass
+
+# same layout as Zookeeper/zk_leader_election (1).py
+APP_NODE = "/simplemr"
+WORKERS_NODE = f"{APP_NODE}/workers"
+LEADER_NODE = f"{APP_NODE}/leader"
+
+AUTHKEY = b'simplemr'  # for the registry and the sockets between nodes
+SESSION_TIMEOUT = 2.0  # seconds without heartbeats after which a session's ephemeral nodes are deleted
+HEARTBEAT_INTERVAL = 0.1  # seconds between heartbeats, which also check watches
+
+WatchedEvent = namedtuple('WatchedEvent', 'type path')
+
+
+class SessionExpiredError(Exception):
+    pass
+
+
+class FakeZooKeeper:
+    """An in-memory stand-in for a ZooKeeper server: a tree of nodes with data, some of them ephemeral.
+
+    Clients open a session and keep it alive with heartbeats; when a session expires (or is closed), its
+    ephemeral nodes are deleted. Every node has a version, increased whenever it's created, changed or deleted,
+    and a version of its list of children: clients implement watches by polling them (see RegistryClient).
+    """
+
+    def __init__(self, session_timeout=SESSION_TIMEOUT):
+        self.session_timeout = session_timeout
+        self.lock = threading.RLock()  # the manager serves each client connection in its own thread
+        self.nodes = {'/': b''}  # path -> data
+        self.owners = {}  # ephemeral node path -> session id
+        self.versions = {}  # path -> version of the node
+        self.child_versions = {}  # path -> version of its list of children
+        self.sessions = {}  # session id -> time of the last heartbeat
+        self.session_ids = itertools.count(1)
+        self.sequence = itertools.count()
+
+    def connect(self):
+        with self.lock:
+            self.expire()
+            session = next(self.session_ids)
+            self.sessions[session] = time.monotonic()
+            return session
+
+    def heartbeat(self, session):
+        with self.lock:
+            if session not in self.sessions:
+                raise SessionExpiredError(session)
+            self.sessions[session] = time.monotonic()
+            self.expire()
+
+    def expire(self):
+        """Close expired sessions: checked on every heartbeat, and on requests that may see their nodes."""
+        now = time.monotonic()
+        for session, last in list(self.sessions.items()):
+            if now - last > self.session_timeout:
+                self.close(session)
+
+    def close(self, session):
+        with self.lock:
+            self.sessions.pop(session, None)
+            for path, owner in list(self.owners.items()):
+                if owner == session:
+                    self.delete(path)
+
+    def changed(self, path):
+        parent = path.rsplit('/', 1)[0] or '/'
+        self.versions[path] = self.versions.get(path, 0) + 1
+        self.child_versions[parent] = self.child_versions.get(parent, 0) + 1
+
+    def create(self, session, path, value=b'', ephemeral=False, sequence=False, makepath=False):
+        with self.lock:
+            self.expire()
+            if sequence:
+                path = f'{path}{next(self.sequence):010}'
+            if path in self.nodes:
+                raise NodeExistsError(path)
+            parent = path.rsplit('/', 1)[0] or '/'
+            if parent not in self.nodes:
+                if not makepath:
+                    raise NoNodeError(parent)
+                self.create(session, parent, makepath=True)
+            self.nodes[path] = value
+            if ephemeral:
+                self.owners[path] = session
+            self.changed(path)
+            return path
+
+    def ensure_path(self, session, path):
+        with self.lock:
+            if path not in self.nodes:
+                self.create(session, path, makepath=True)
+
+    def get(self, path):
+        """Return the data of the node at path, and its version."""
+        with self.lock:
+            self.expire()
+            try:
+                return self.nodes[path], self.versions[path]
+            except KeyError:
+                raise NoNodeError(path) from None
+
+    def set(self, path, value):
+        with self.lock:
+            if path not in self.nodes:
+                raise NoNodeError(path)
+            self.nodes[path] = value
+            self.versions[path] += 1
+
+    def get_children(self, path):
+        with self.lock:
+            self.expire()
+            if path not in self.nodes:
+                raise NoNodeError(path)
+            prefix = path.rstrip('/') + '/'
+            return sorted(p[len(prefix):] for p in self.nodes if p.startswith(prefix) and '/' not in p[len(prefix):])
+
+    def delete(self, path):
+        with self.lock:
+            if path not in self.nodes:
+                raise NoNodeError(path)
+            del self.nodes[path]
+            self.owners.pop(path, None)
+            self.changed(path)
+
+    def watch_versions(self, watches):
+        """Current versions for a list of (path, children) pairs: of the node or, if children, of its children."""
+        with self.lock:
+            return [(self.child_versions if children else self.versions).get(path, 0) for path, children in watches]
+
+
+class RegistryManager(BaseManager):
+    pass
+
+
+RegistryManager.register('registry')
+
+
+def serve_registry(registry, address=('localhost', 0)):
+    """Serve registry (a FakeZooKeeper) to other processes from a thread of this one; return its address."""
+    RegistryManager.register('registry', callable=lambda: registry)
+    server = RegistryManager(address, authkey=AUTHKEY).get_server()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.address
+
+
+class RegistryClient:
+    """The part of the kazoo.client.KazooClient API used here, for a FakeZooKeeper served by serve_registry.
+
+    As in kazoo, watches are one-shot callbacks called from a background thread, receiving a WatchedEvent; they're
+    checked by the same thread that sends heartbeats.
+    """
+
+    def __init__(self, address):
+        self.address = address
+        self.watches = []  # (path, children, version when set, callback)
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def start(self):
+        manager = RegistryManager(self.address, authkey=AUTHKEY)
+        manager.connect()
+        self.registry = manager.registry()
+        self.session = self.registry.connect()
+        self.heartbeats = threading.Thread(target=self.keep_alive, daemon=True)
+        self.heartbeats.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.heartbeats.join()
+        self.registry.close(self.session)
+
+    def keep_alive(self):
+        while not self.stopped.wait(HEARTBEAT_INTERVAL):
+            self.registry.heartbeat(self.session)
+            with self.lock:
+                watches = self.watches
+            if not watches:
+                continue
+            versions = self.registry.watch_versions([(path, children) for path, children, _, _ in watches])
+            fired = [watch for watch, version in zip(watches, versions) if version != watch[2]]
+            with self.lock:
+                self.watches = [watch for watch in self.watches if watch not in fired]
+            for path, children, _, callback in fired:
+                callback(WatchedEvent('CHILD' if children else 'CHANGED', path))
+
+    def add_watch(self, path, children, callback):
+        if callback is not None:
+            version, = self.registry.watch_versions([(path, children)])
+            watch = path, children, version, callback
+            with self.lock:
+                self.watches.append(watch)
+            return watch
+
+    def remove_watch(self, watch):
+        if watch is not None:
+            with self.lock:
+                self.watches = [w for w in self.watches if w is not watch]
+
+    def create(self, path, value=b'', ephemeral=False, sequence=False, makepath=False):
+        return self.registry.create(self.session, path, value, ephemeral, sequence, makepath)
+
+    def ensure_path(self, path):
+        self.registry.ensure_path(self.session, path)
+
+    def get(self, path, watch=None):
+        watch = self.add_watch(path, False, watch)  # before reading, so that no change goes unnoticed
+        try:
+            return self.registry.get(path)
+        except NoNodeError:
+            self.remove_watch(watch)  # as in ZooKeeper, reading a missing node sets no watch
+            raise
+
+    def get_children(self, path, watch=None):
+        watch = self.add_watch(path, True, watch)
+        try:
+            return self.registry.get_children(path)
+        except NoNodeError:
+            self.remove_watch(watch)
+            raise
+
+    def set(self, path, value):
+        self.registry.set(path, value)
+
+    def delete(self, path):
+        self.registry.delete(path)
+
+
+def connect_registry(hosts):
+    """A started client for the registry at hosts: a (host, port) address of a FakeZooKeeper served by
+    serve_registry, or a ZooKeeper connection string such as 'localhost:2181' (this needs kazoo)."""
+    if isinstance(hosts, str):
+        from kazoo.client import KazooClient
+        zk = KazooClient(hosts=hosts)
+    else:
+        zk = RegistryClient(hosts)
+    zk.start()
+    return zk
+
+
+def encode_address(address):
+    return f'{address[0]}:{address[1]}'.encode('ascii')
+
+
+def decode_address(data):
+    host, port = data.decode('ascii').rsplit(':', 1)
+    return host, int(port)
+
+
+class ClusterPool:
+    """Runs simplemr tasks on the nodes registered in WORKERS_NODE, with the part of the multiprocessing.Pool API
+    used by MapReduce.run_parallel (apply_async).
+
+    Each node gets a dispatcher thread, which sends it one task at a time over a socket: faster nodes take more
+    tasks. Nodes joining later are used as soon as the watch on WORKERS_NODE notices them; if a node's connection
+    breaks, its task fails with the connection error, so that run_parallel retries it on another node.
+    """
+
+    def __init__(self, zk):
+        self.zk = zk
+        self.tasks = queue.Queue()
+        self.dispatchers = {}  # node name -> thread
+        self.lock = threading.Lock()
+        self.closed = False
+        self.update_nodes()
+
+    def update_nodes(self, event=None):
+        if self.closed:
+            return
+        for name in self.zk.get_children(WORKERS_NODE, watch=self.update_nodes):
+            with self.lock:
+                if name in self.dispatchers:
+                    continue
+                try:
+                    data, _ = self.zk.get(f'{WORKERS_NODE}/{name}')
+                except NoNodeError:
+                    continue  # gone in the meantime
+                dispatcher = threading.Thread(target=self.dispatch, args=(name, decode_address(data)), daemon=True)
+                self.dispatchers[name] = dispatcher
+                dispatcher.start()
+
+    def __len__(self):
+        return len(self.dispatchers)
+
+    def dispatch(self, name, address):
+        try:
+            with Client(address, authkey=AUTHKEY) as connection:
+                while (task := self.tasks.get()) is not None:
+                    function, args, callback, error_callback = task
+                    try:
+                        connection.send(('task', function, args))
+                        success, result = connection.recv()
+                    except (OSError, EOFError) as e:
+                        error_callback(e)
+                        return
+                    (callback if success else error_callback)(result)
+        except OSError:
+            pass  # the node died before we could connect
+        finally:
+            with self.lock:
+                del self.dispatchers[name]
+
+    def apply_async(self, function, args=(), callback=None, error_callback=None):
+        self.tasks.put((function, args, callback, error_callback))
+
+    def close(self):
+        """Drop queued tasks (e.g., duplicates of completed ones) and stop the dispatchers after their current task."""
+        self.closed = True
+        with self.lock:
+            while not self.tasks.empty():
+                self.tasks.get_nowait()
+            for _ in self.dispatchers:
+                self.tasks.put(None)
+
+
+class Node:
+    """A member of the cluster: runs the tasks it receives, and coordinates jobs when it's the leader.
+
+    The node registers an ephemeral node with the address of its socket in WORKERS_NODE, and takes part in the
+    election of the leader as in Zookeeper/zk_leader_election (1).py, by creating the ephemeral LEADER_NODE.
+    """
+
+    def __init__(self, hosts, name):
+        self.hosts = hosts
+        self.name = name
+        self.leader = None
+
+    def run(self):
+        self.zk = connect_registry(self.hosts)
+        with Listener(('localhost', 0), authkey=AUTHKEY) as listener:
+            self.address = encode_address(listener.address)
+            self.zk.ensure_path(WORKERS_NODE)
+            self.zk.create(f'{WORKERS_NODE}/{self.name}', self.address, ephemeral=True)
+            self.choose_leader()
+            while True:
+                connection = listener.accept()
+                threading.Thread(target=self.serve, args=(connection,), daemon=True).start()
+
+    def choose_leader(self, event=None):
+        """Find out the leader, becoming it if there's none; a watch calls this again when the leader changes.
+
+        Only the successful read sets the watch (reading a missing node sets none), so there's never more than one.
+        """
+        while True:
+            try:
+                self.zk.create(LEADER_NODE, self.address, ephemeral=True)
+            except NodeExistsError:
+                pass
+            try:
+                self.leader, _ = self.zk.get(LEADER_NODE, watch=self.choose_leader)
+                return
+            except NoNodeError:
+                pass  # the leader left before we could read it: run again
+
+    def serve(self, connection):
+        with connection:
+            while True:
+                try:
+                    request, *args = connection.recv()
+                except (OSError, EOFError):
+                    return
+                try:
+                    if request == 'task':
+                        function, function_args = args
+                        result = True, function(*function_args)
+                    elif request == 'job':
+                        result = True, self.coordinate(*args)
+                    else:
+                        raise ValueError(f"unknown request {request!r}")
+                except Exception as e:
+                    result = False, e
+                try:
+                    connection.send(result)
+                except OSError:
+                    return  # whoever sent the request is gone (e.g., a leader that crashed)
+
+    def coordinate(self, job, data, chunk_size):
+        """Run job on data with a reducer per node, as the leader; return its output and statistics."""
+        if self.leader != self.address:
+            raise RuntimeError(f"node {self.name} is not the leader")
+        pool = ClusterPool(self.zk)
+        try:
+            if not len(pool):
+                raise RuntimeError(f"no nodes registered in {WORKERS_NODE}: there's nowhere to run the tasks")
+            job.new_stats()
+            output = list(job.run_parallel(data, len(pool), chunk_size, pool=pool))
+        finally:
+            pool.close()
+        return output, job.stats
+
+
+def run_node(hosts, name):
+    Node(hosts, name).run()
+
+
+def wait_for_leader(zk, previous=None, timeout=3 * SESSION_TIMEOUT):
+    """Return the address of the leader, waiting up to timeout seconds for one different from previous."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            leader, _ = zk.get(LEADER_NODE)
+        except NoNodeError:
+            leader = None
+        if leader is not None and (leader != previous or time.monotonic() > deadline):
+            return leader
+        if time.monotonic() > deadline:
+            raise NoNodeError(LEADER_NODE)
+        time.sleep(HEARTBEAT_INTERVAL)
+
+
+def run_on_cluster(job, data, hosts, chunk_size=4096, attempts=3):
+    """Run job on data on the cluster whose registry is at hosts, through its leader, and return its output.
+
+    data is sent to the leader, which splits it among the nodes; a MappedFile is only sent as its path and range.
+    If the leader fails, the job is submitted again to the next one, up to attempts times in all.
+    """
+    zk = connect_registry(hosts)
+    leader = None
+    try:
+        for attempt in range(attempts):
+            try:
+                leader = wait_for_leader(zk, leader)
+                with Client(decode_address(leader), authkey=AUTHKEY) as connection:
+                    connection.send(('job', job, data, chunk_size))
+                    success, result = connection.recv()
+            except (OSError, EOFError):
+                if attempt == attempts - 1:
+                    raise
+                continue
+            if not success:
+                raise result
+            output, job.stats = result
+            job.counters = job.stats.counters
+            return output
+    finally:
+        zk.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--nodes', nargs='+', type=int, default=[1, 2, 4], help="cluster sizes to try")
+    parser.add_argument('--zookeeper', help="a ZooKeeper server to use (e.g., localhost:2181) instead of the "
+                        "in-process fake registry; needs kazoo")
+    args = parser.parse_args()
+
+    hosts = args.zookeeper or serve_registry(FakeZooKeeper())
+    expected = sorted(WordCountCombine().run(open('mobydick.txt')))
+    for n_nodes in args.nodes:
+        nodes = [multiprocessing.Process(target=run_node, args=(hosts, f'node{i}'), daemon=True)
+                 for i in range(n_nodes)]
+        for node in nodes:
+            node.start()
+        zk = connect_registry(hosts)
+        zk.ensure_path(WORKERS_NODE)
+        while len(zk.get_children(WORKERS_NODE)) < n_nodes:
+            time.sleep(HEARTBEAT_INTERVAL)
+        zk.stop()
+
+        start = time.perf_counter()
+        output = run_on_cluster(WordCountCombine(), simplemr.MappedFile('mobydick.txt'), hosts)
+        elapsed = time.perf_counter() - start
+        print(f"{n_nodes} nodes: {elapsed:.2f}s, same output as a serial run: {sorted(output) == expected}")
+
+        for node in nodes:
+            node.terminate()
+            node.join()
+        time.sleep(2 * SESSION_TIMEOUT)  # let their ephemeral nodes expire before starting the next cluster
+
+
+if __name__ == '__main__':
+    main()
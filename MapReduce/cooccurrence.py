@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 
 import collections
-import heapq
 import re
 
 import simplemr
@@ -12,6 +11,8 @@ with open("stopwords") as f:
     STOPWORDS = set(f.read().split())
 
 class PairCoOccurrence(simplemr.MapReduceCombine):
+    grouping = 'hash'  # we don't need sorted output: skip sorting millions of pairs
+
     def __init__(self, window):
         self.window = window
     
@@ -28,9 +29,15 @@ class PairCoOccurrence(simplemr.MapReduceCombine):
 
     def reduce(self, k, vs):
         yield k, sum(vs)
-        
+
+
+class PairCoOccurrenceAggregate(PairCoOccurrence):
+    aggregator = simplemr.Sum()  # replaces combine and reduce
+
 
 class StripesCoOccurrence(simplemr.MapReduceCombine):
+    grouping = 'hash'
+
     def __init__(self, window):
         self.window = window
     
@@ -74,10 +81,13 @@ class StripesCoOccurrence(simplemr.MapReduceCombine):
 if __name__ == '__main__':
     print("Pairs")
     with open('mobydick.txt') as f:
-        print(heapq.nlargest(10, PairCoOccurrence(4).run(f), key=simplemr.second))
+        print(PairCoOccurrence(4).top(f, 10))
+
+    print("Pairs with aggregator")
+    with open('mobydick.txt') as f:
+        print(PairCoOccurrenceAggregate(4).top(f, 10))
 
     print("Stripes")
     with open('mobydick.txt') as f:
-        output = StripesCoOccurrence(4).run(f)
-        print(heapq.nlargest(10, output, key=simplemr.second))
+        print(StripesCoOccurrence(4).top(f, 10))
 
@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 
 import csv
-import heapq
 
 import simplemr
 
@@ -38,15 +37,44 @@ class FifaMeanCombine(simplemr.MapReduceCombine):
         yield club, s/count
 
 
+class FifaMeanAggregate(FifaMean):
+    aggregator = simplemr.Mean()  # (sum, count) partial aggregates, as in FifaMeanCombine
+
+
+class FifaMeanColumnar(FifaMean):
+    """FifaMeanAggregate on blocks of columns read by simplemr.CSVColumns, rather than on a dictionary per row."""
+
+    aggregator = simplemr.Mean()
+
+    def map(self, block):
+        return zip(block['Club'], block['Overall'])
+
+
+def fifa_columns(f):
+    return simplemr.CSVColumns(f, ['Club', 'Overall'], types={'Overall': 'q'})
+
+
 if __name__ == '__main__':
 
     print("Without combiner")
     with open('fifa21.csv') as f:
-        output = FifaMean().run(csv.DictReader(f))
-        print(heapq.nlargest(10, output, key=simplemr.second))
+        print(FifaMean().top(csv.DictReader(f), 10))
 
     print("With combiner")
     with open('fifa21.csv') as f:
-        output = FifaMeanCombine().run(csv.DictReader(f))
-        print(heapq.nlargest(10, output, key=simplemr.second))
+        print(FifaMeanCombine().top(csv.DictReader(f), 10))
+
+    print("With combiner, parsing the CSV file in a background thread")
+    with open('fifa21.csv') as f:
+        job = FifaMeanCombine()
+        job.prefetch = 8
+        print(job.top(csv.DictReader(f), 10))
+
+    print("With aggregator")
+    with open('fifa21.csv') as f:
+        print(FifaMeanAggregate().top(csv.DictReader(f), 10))
+
+    print("With aggregator, reading only the needed columns")
+    with open('fifa21.csv', newline='') as f:
+        print(FifaMeanColumnar().top(fifa_columns(f), 10))
 
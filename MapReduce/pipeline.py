@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+
+import simplemr
+from cooccurrence import STOPWORDS, WORD_RE
+
+
+class Dataset:
+    """A lazily evaluated collection of records: a source transformed by a chain of stages.
+
+    Stages are added with map (map-only stages), run (a simplemr job) and cache; nothing is computed until the
+    dataset is iterated. The source must be iterable more than once (e.g., a list, a simplemr.MappedFile or a
+    simplemr.PartitionedOutput, but not a file object) unless a cache stage makes sure it's read only once.
+    """
+
+    def __init__(self, source):
+        self.source = source
+
+    def __iter__(self):
+        return iter(self.source)
+
+    def map(self, function):
+        """A map-only stage: function receives each record and returns an iterable of output records."""
+        return MapStage(self, function)
+
+    def run(self, job, **run_args):
+        """A stage whose records are the output of job.run on this dataset, with the given arguments."""
+        return JobStage(self, job, run_args)
+
+    def cache(self, path=None):
+        """A stage computing this dataset only once, and keeping it in memory (or in the file path, if given).
+
+        Downstream stages sharing the cache (e.g., several jobs on the same tokenized corpus) reuse the same records.
+        """
+        if path is None:
+            return MemoryCache(self)
+        return DiskCache(self, path)
+
+
+class MapStage(Dataset):
+    def __init__(self, parent, function):
+        self.parent = parent
+        self.function = function
+
+    def __iter__(self):
+        function = self.function
+        for record in self.parent:
+            yield from function(record)
+
+
+class JobStage(Dataset):
+    def __init__(self, parent, job, run_args):
+        self.parent = parent
+        self.job = job
+        self.run_args = run_args
+
+    def __iter__(self):
+        return iter(self.job.run(self.parent, **self.run_args))
+
+
+class MemoryCache(Dataset):
+    def __init__(self, parent):
+        self.parent = parent
+        self.records = None
+
+    def __iter__(self):
+        if self.records is None:
+            self.records = list(self.parent)
+        return iter(self.records)
+
+
+class DiskCache(Dataset):
+    """Records are stored in pickled blocks, as the runs spilled by simplemr's external grouping."""
+
+    def __init__(self, parent, path):
+        self.parent = parent
+        self.path = path
+        self.written = False
+
+    def __iter__(self):
+        if not self.written:
+            with open(self.path, 'wb') as f:
+                simplemr.write_run(self.parent, f)
+            self.written = True
+        return self.read()
+
+    def read(self):
+        with open(self.path, 'rb') as f:
+            yield from simplemr.read_run(f)
+
+
+def tokenize(line):
+    """The words of a line, lowercased and without stopwords: one record per line, as a list."""
+    yield [w for w in WORD_RE.findall(line.lower()) if w not in STOPWORDS]
+
+
+class TokenCount(simplemr.MapReduce):
+    """Word count on tokenized lines."""
+
+    aggregator = simplemr.Sum()
+
+    def map(self, words):
+        for w in words:
+            yield w, 1
+
+
+class TokenPairCoOccurrence(simplemr.MapReduce):
+    """Pair co-occurrence on tokenized lines."""
+
+    aggregator = simplemr.Sum()
+
+    def __init__(self, window):
+        self.window = window
+
+    def map(self, words):
+        for i, w1 in enumerate(words):
+            for w2 in words[i + 1:i + self.window]:
+                yield ((w1, w2) if w1 < w2 else (w2, w1)), 1
+
+
+class CountHistogram(simplemr.MapReduce):
+    """Takes (key, count) pairs and counts how many keys have each count."""
+
+    aggregator = simplemr.Count()
+
+    def map(self, pair):
+        yield pair[1], None
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as tmp:
+        # tokenization and stopword filtering happen once, when the first job reads the cache
+        tokens = Dataset(simplemr.MappedFile('mobydick.txt')).map(tokenize).cache(os.path.join(tmp, 'tokens'))
+        word_counts = tokens.run(TokenCount()).cache()
+
+        print("Word count")
+        print(TokenCount().top(tokens, 10))
+        print("Pairs")
+        print(TokenPairCoOccurrence(4).top(tokens, 10))
+        print("Words per number of occurrences")
+        print(sorted(word_counts.run(CountHistogram()))[:10])
+        print("Distinct words")
+        print(len(list(word_counts)))
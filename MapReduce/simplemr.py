@@ -1,5 +1,25 @@
+from array import array
+import bisect
+import csv
+import heapq
+import io
+import json
+import math
+import mmap
+import multiprocessing
+import os
+import pickle
+import queue
+import random
+import tempfile
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict, defaultdict
+from contextlib import ExitStack
+from dataclasses import dataclass
 from functools import partial
-from itertools import groupby, islice
+from itertools import chain, count, groupby, islice
 from operator import itemgetter
 
 # from the more_itertools package (https://more-itertools.readthedocs.io/)
@@ -45,7 +65,875 @@ def chunked(iterable, n):
 first = itemgetter(0)   # returns 1st element in a tuple
 second = itemgetter(1)  # returns the 2nd element in a tuple
 
+
+def partition(key, n):
+    """Return the index of the reducer (out of *n*) responsible for *key*.
+
+    We can't use the built-in hash(): string hashes are randomized in each process, while all the workers must send
+    the same key to the same reducer.
+    """
+    return zlib.crc32(repr(key).encode()) % n
+
+
+class HashPartitioner:
+    def __init__(self, n):
+        self.n = n
+
+    def __call__(self, key):
+        return partition(key, self.n)
+
+
+class RangePartitioner:
+    """Partitions keys by ranges: keys smaller than boundaries[0] go to reducer 0, and so on."""
+
+    def __init__(self, boundaries):
+        self.boundaries = boundaries
+
+    def __call__(self, key):
+        return bisect.bisect_right(self.boundaries, key)
+
+
+class SaltedPartitioner(HashPartitioner):
+    """Hash partitioning, except that the pairs of each hot key are spread round-robin among several reducers.
+
+    hot_keys maps each hot key to the number of reducers it's spread among, starting from its hash partition; their
+    partial results must be merged by a second stage (see MapReduce.merge_hot_keys).
+    """
+
+    def __init__(self, n, hot_keys):
+        super().__init__(n)
+        self.hot_keys = hot_keys
+        self.turns = {}  # hot key -> function returning its next turn, created by each task
+
+    def __call__(self, key):
+        salts = self.hot_keys.get(key)
+        if salts is None:
+            return partition(key, self.n)
+        turn = self.turns.get(key)
+        if turn is None:
+            # a counter per key, or keys emitted alternately would always get the same salt; starting at random,
+            # so that tasks emitting few pairs of a key don't all send them to its first reducer
+            turn = self.turns[key] = count(random.randrange(salts)).__next__
+        return (partition(key, self.n) + turn() % salts) % self.n
+
+
+def reservoir_sample(iterable, k, rng=random):
+    """Return k items of iterable chosen uniformly at random (all of them, if there are fewer), in a single pass."""
+    sample = []
+    for i, item in enumerate(iterable):
+        if i < k:
+            sample.append(item)
+        else:
+            j = rng.randrange(i + 1)
+            if j < k:
+                sample[j] = item
+    return sample
+
+
+def salt_hot_keys(hot, loads, max_load):
+    """Choose among how many reducers to spread each of the hot (key, frequency) pairs, on top of loads.
+
+    From the most frequent, each key gets as few consecutive reducers (from its hash partition) as keep them all
+    below max_load; if a key doesn't fit anyway, all the hot keys are spread among all the reducers.
+    """
+    n = len(loads)
+    loads = loads.copy()
+    hot_keys = {}
+    for key, frequency in sorted(hot, key=second, reverse=True):
+        start = partition(key, n)
+        peak = 0  # load of the busiest reducer among the first `salts` ones
+        for salts in range(1, n + 1):
+            peak = max(peak, loads[(start + salts - 1) % n])
+            if peak + frequency / salts <= max_load:
+                break
+        else:
+            return {key: n for key, _ in hot}
+        for i in range(salts):
+            loads[(start + i) % n] += frequency / salts
+        hot_keys[key] = salts
+    return hot_keys
+
+
+def sample_partitioner(key_counts, n, strategy, max_imbalance):
+    """Build a partitioner for n reducers from key_counts, the frequencies of keys in a sample of the map output.
+
+    With the 'range' strategy, boundaries are quantiles of the sampled keys, weighted by frequency; with 'salted',
+    keys are hashed from the least to the most frequent, and those that would load their reducer more than
+    max_imbalance times the average (counting the keys already there) are spread among several (see salt_hot_keys).
+    """
+    total = sum(key_counts.values())
+    if strategy == 'range':
+        boundaries = []
+        cumulative, quantile = 0, 1
+        for key, frequency in sorted(key_counts.items(), key=first):
+            cumulative += frequency
+            while quantile < n and cumulative > total * quantile / n:
+                # key holds the quantile-th n-quantile: it becomes the first key of a partition (only once, as a
+                # single key can't be split among reducers: that's what 'salted' partitioning is for)
+                quantile += 1
+                if key not in boundaries[-1:]:
+                    boundaries.append(key)
+        return RangePartitioner(boundaries)
+    if strategy == 'salted':
+        max_load = max_imbalance * total / n
+        loads = [0] * n
+        hot = []
+        for key, frequency in sorted(key_counts.items(), key=second):
+            i = partition(key, n)
+            if loads[i] + frequency <= max_load:
+                loads[i] += frequency
+            else:
+                hot.append((key, frequency))
+        return SaltedPartitioner(n, salt_hot_keys(hot, loads, max_load))
+    if strategy == 'hash':
+        return HashPartitioner(n)
+    raise ValueError(f"unknown partitioning strategy {strategy!r}")
+
+
+SPILL_BLOCK_SIZE = 4096  # pairs pickled together when writing a run to disk
+
+def write_run(kvpairs, f):
+    """Write a sorted run of pairs to the binary file f, in pickled blocks, and rewind it."""
+    for block in chunked(kvpairs, SPILL_BLOCK_SIZE):
+        pickle.dump(block, f, pickle.HIGHEST_PROTOCOL)
+    f.seek(0)
+
+def read_run(f):
+    """Iterate over the pairs written by write_run, loading only one block at a time in memory."""
+    while True:
+        try:
+            block = pickle.load(f)
+        except EOFError:
+            return
+        yield from block
+
+
+class Aggregator:
+    """A declarative, associative aggregation of the values of each key.
+
+    A job setting e.g. `aggregator = Sum()` needs neither combine nor reduce: simplemr uses the aggregator as both.
+    Map output is folded into one partial value per key (`combine`), partial values are merged (`merge` or
+    `merge_values`) and turned into the final result by `finalize`. Subclasses implement these with tight loops over
+    dictionaries rather than with a generator call per key.
+    """
+
+    def combine(self, kvpairs):
+        """Return a dictionary mapping each key of kvpairs to the partial aggregate of its values."""
+        raise NotImplementedError
+
+    def merge(self, kvpartials):
+        """Return a dictionary mapping each key of kvpartials to the merge of its partial aggregates."""
+        raise NotImplementedError
+
+    def merge_values(self, partials):
+        """Merge the partial aggregates of a single key."""
+        raise NotImplementedError
+
+    def finalize(self, aggregate):
+        return aggregate
+
+
+class Sum(Aggregator):
+    def combine(self, kvpairs):
+        result = {}
+        get = result.get
+        for k, v in kvpairs:
+            result[k] = get(k, 0) + v
+        return result
+
+    merge = combine
+
+    def merge_values(self, partials):
+        return sum(partials)
+
+
+class Count(Sum):
+    def combine(self, kvpairs):
+        return Counter(map(first, kvpairs))  # counting is done in C
+
+
+class Mean(Aggregator):
+    """Partial aggregates are (sum, count) pairs."""
+
+    def combine(self, kvpairs):
+        sums, counts = {}, Counter()
+        get = sums.get
+        for k, v in kvpairs:
+            sums[k] = get(k, 0) + v
+            counts[k] += 1
+        return {k: (s, counts[k]) for k, s in sums.items()}
+
+    def merge(self, kvpartials):
+        sums, counts = {}, Counter()
+        get = sums.get
+        for k, (s, c) in kvpartials:
+            sums[k] = get(k, 0) + s
+            counts[k] += c
+        return {k: (s, counts[k]) for k, s in sums.items()}
+
+    def merge_values(self, partials):
+        total = count = 0
+        for s, c in partials:
+            total += s
+            count += c
+        return total, count
+
+    def finalize(self, aggregate):
+        s, count = aggregate
+        return s / count
+
+
+class Min(Aggregator):
+    def combine(self, kvpairs):
+        result = {}
+        get = result.get
+        for k, v in kvpairs:
+            current = get(k)
+            if current is None or v < current:
+                result[k] = v
+        return result
+
+    merge = combine
+
+    def merge_values(self, partials):
+        return min(partials)
+
+
+class Max(Aggregator):
+    def combine(self, kvpairs):
+        result = {}
+        get = result.get
+        for k, v in kvpairs:
+            current = get(k)
+            if current is None or v > current:
+                result[k] = v
+        return result
+
+    merge = combine
+
+    def merge_values(self, partials):
+        return max(partials)
+
+
+class CounterMerge(Aggregator):
+    """Values are mappings (e.g. collections.Counter) whose counts are summed up."""
+
+    def combine(self, kvpairs):
+        result = {}
+        get = result.get
+        for k, v in kvpairs:
+            counter = get(k)
+            if counter is None:
+                result[k] = Counter(v)
+            else:
+                counter.update(v)
+        return result
+
+    merge = combine
+
+    def merge_values(self, partials):
+        result = Counter()
+        for c in partials:
+            result.update(c)
+        return result
+
+
+class MappedFile:
+    """A text file read through mmap, which can be split in line-aligned byte ranges for parallel map tasks.
+
+    Iterating over it yields lines like a file opened in text mode; blocks() yields larger strings made of whole
+    lines. A MappedFile only stores the path and its byte range, so when it is passed to run(..., workers=N) each
+    worker reads its own split rather than receiving the lines from the driver. Records must not span lines (e.g.,
+    CSV fields with embedded newlines are not supported).
+    """
+
+    block_size = 1 << 20  # approximate size, in bytes, of the blocks decoded at once
+
+    def __init__(self, path, start=0, end=None, encoding='utf-8'):
+        self.path = path
+        self.start = start
+        self.end = end  # None: until the end of the file
+        self.encoding = encoding
+
+    def split(self, n):
+        """Split the byte range in (at most) n MappedFiles of similar size, each starting at a line boundary."""
+        end = os.path.getsize(self.path) if self.end is None else self.end
+        if end <= self.start:
+            return []
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            step = max((end - self.start) // n, 1)
+            bounds = [self.start]
+            while bounds[-1] < end:
+                newline = mm.find(b'\n', bounds[-1] + step - 1, end)
+                bounds.append(end if newline == -1 else newline + 1)
+        return [MappedFile(self.path, start, stop, self.encoding) for start, stop in zip(bounds, bounds[1:])]
+
+    def blocks(self):
+        """Yield the content of the byte range as strings of about block_size bytes, ending at line boundaries."""
+        end = os.path.getsize(self.path) if self.end is None else self.end
+        if end <= self.start:
+            return  # also, empty files can't be memory-mapped
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = self.start
+            while pos < end:
+                stop = min(pos + self.block_size, end)
+                if stop < end:
+                    newline = mm.rfind(b'\n', pos, stop)
+                    if newline == -1:  # a line longer than block_size
+                        newline = mm.find(b'\n', stop, end)
+                    stop = end if newline == -1 else newline + 1
+                yield mm[pos:stop].decode(self.encoding)
+                pos = stop
+
+    def __iter__(self):
+        for block in self.blocks():
+            yield from io.StringIO(block, newline=None)  # translates newlines, like open() in text mode
+
+    def __repr__(self):
+        return f"MappedFile({self.path!r}, {self.start}, {self.end})"
+
+
+COLUMN_BLOCK_SIZE = 65_536  # CSV rows per block of columns
+
+
+class CSVColumns:
+    """Read only some columns of a CSV file, in blocks: each record is a dictionary mapping column names to lists.
+
+    Rows are parsed by csv.reader and transposed in C, without building a dictionary per row as csv.DictReader does.
+    types maps column names to array typecodes (e.g., 'q' for integers, 'd' for floats): those columns are converted
+    in one pass to compact typed arrays. Other keyword arguments are passed to csv.reader.
+    """
+
+    def __init__(self, f, columns, types=None, block_size=COLUMN_BLOCK_SIZE, **reader_args):
+        self.f = f
+        self.columns = columns
+        self.types = types or {}
+        self.block_size = block_size
+        self.reader_args = reader_args
+
+    def __iter__(self):
+        reader = csv.reader(self.f, **self.reader_args)
+        header = next(reader, None)
+        if header is None:
+            return  # an empty file, without even a header
+        missing = [name for name in self.columns if name not in header]
+        if missing:
+            raise ValueError(f"columns {missing} not in the CSV header {header}")
+        getters = [itemgetter(header.index(name)) for name in self.columns]
+        for rows in chunked(reader, self.block_size):
+            block = {}
+            for name, getter in zip(self.columns, getters):
+                values = list(map(getter, rows))
+                typecode = self.types.get(name)
+                if typecode is not None:
+                    values = array(typecode, map(float if typecode in 'fd' else int, values))
+                block[name] = values
+            yield block
+
+
+PREFETCH_TIMEOUT = 0.1  # seconds between checks, by a blocked reader thread, that the consumer is still there
+
+
+class Prefetcher:
+    """Iterate over source in a background thread, which reads ahead up to depth batches of batch_size records.
+
+    Reading, decompressing (e.g., gzip.open) and parsing (e.g., csv.DictReader) the input then overlap with the
+    map phase: file reads and zlib release the GIL, so the mapper keeps running meanwhile. Exceptions raised by
+    source are re-raised by the iterator; if the iterator is closed early, the reader thread stops.
+    """
+
+    def __init__(self, source, batch_size=1024, depth=8):
+        self.source = source
+        self.batch_size = batch_size
+        self.depth = depth
+
+    def read(self, batches, stop):
+        def put(item):
+            """Put item in batches, unless the consumer is gone; return whether it was put."""
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=PREFETCH_TIMEOUT)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        try:
+            for batch in chunked(self.source, self.batch_size):
+                if not put(batch):
+                    return
+            put(None)  # end of input
+        except BaseException as e:
+            put(e)
+
+    def __iter__(self):
+        batches, stop = queue.Queue(self.depth), threading.Event()
+        reader = threading.Thread(target=self.read, args=(batches, stop), daemon=True)
+        reader.start()
+        try:
+            while (batch := batches.get()) is not None:
+                if isinstance(batch, BaseException):
+                    raise batch
+                yield from batch
+        finally:
+            stop.set()
+            reader.join()
+
+
+METER_BATCH_SIZE = 1024  # records read ahead by instrumented phases, to amortize the cost of reading clocks
+
+def meter(iterable, stats, batch_size=METER_BATCH_SIZE):
+    """Yield the items of iterable, adding to stats how many they are and the wall and CPU time to produce them.
+
+    Times include the time spent in the phases before this one: JobStats.finish subtracts it.
+    """
+    it = iter(iterable)
+    while True:
+        wall, cpu = time.perf_counter(), time.process_time()
+        batch = take(batch_size, it)
+        stats.wall_time += time.perf_counter() - wall
+        stats.cpu_time += time.process_time() - cpu
+        stats.records += len(batch)
+        yield from batch
+        if len(batch) < batch_size:
+            return
+
+
+@dataclass
+class PhaseStats:
+    """Records output by a phase, and wall/CPU time spent in it."""
+
+    records: int = 0
+    wall_time: float = 0.0
+    cpu_time: float = 0.0
+
+
+class JobStats:
+    """Statistics of a run, available as job.stats.
+
+    counters are Hadoop-style counters (e.g., 'combine_in', 'spilled_bytes'); phases maps the phases of the job
+    ('input', 'map', 'combine', 'shuffle' and 'reduce') to their PhaseStats, and is only filled if the job has
+    instrument = True. For parallel runs, phase times are summed over all tasks, while wall_time is the time
+    for the whole job.
+    """
+
+    def __init__(self):
+        self.counters = Counter()
+        self.phases = {}  # in pipeline order
+        self.wall_time = 0.0
+        self.partition_records = []  # pairs sent to each reduce task, for parallel runs
+
+    def phase(self, name):
+        return self.phases.setdefault(name, PhaseStats())
+
+    def finish(self):
+        """Subtract from the time of each phase the time of the previous one, which was included in it."""
+        previous_wall = previous_cpu = 0.0
+        for stats in self.phases.values():
+            wall, cpu = stats.wall_time, stats.cpu_time
+            stats.wall_time -= previous_wall
+            stats.cpu_time -= previous_cpu
+            previous_wall, previous_cpu = wall, cpu
+
+    def merge(self, other):
+        """Add the statistics of a (finished) task to these."""
+        self.counters.update(other.counters)
+        for name, other_stats in other.phases.items():
+            stats = self.phase(name)
+            stats.records += other_stats.records
+            stats.wall_time += other_stats.wall_time
+            stats.cpu_time += other_stats.cpu_time
+
+    def combine_ratio(self):
+        """Reduction ratio of the combiner: pairs it received per pair it emitted."""
+        return self.counters['combine_in'] / max(self.counters['combine_out'], 1)
+
+    def as_dict(self):
+        phases = {}
+        records_in = None
+        for name, stats in self.phases.items():
+            phases[name] = {'records_in': stats.records if records_in is None else records_in,
+                            'records_out': stats.records,
+                            'wall_time': stats.wall_time,
+                            'cpu_time': stats.cpu_time}
+            records_in = stats.records
+        result = {'wall_time': self.wall_time, 'counters': dict(self.counters), 'phases': phases}
+        if 'shuffle' in self.phases:
+            result['distinct_keys'] = self.phases['shuffle'].records
+        if self.counters['combine_out']:
+            result['combine_ratio'] = self.combine_ratio()
+        if self.partition_records:
+            result['partition_records'] = self.partition_records
+            result['partition_imbalance'] = self.partition_imbalance()
+        return result
+
+    def partition_imbalance(self):
+        """Load of the busiest reduce task, relative to the average."""
+        mean = sum(self.partition_records) / len(self.partition_records)
+        return max(self.partition_records) / mean if mean else 1.0
+
+    def dump(self, path):
+        """Write the statistics to path as JSON."""
+        with open(path, 'w') as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+
+PAIR_SHIFT = 32  # a pair of word ids (a, b) is packed in a single integer as (a << PAIR_SHIFT) | b
+PAIR_MASK = (1 << PAIR_SHIFT) - 1
+
+class Vocabulary:
+    """Maps strings to consecutive integer ids and back, to make keys cheaper to sort, group and send around.
+
+    Keys can be of two kinds: 'word' (a string) or 'pair' (a pair of strings, packed in a single 64-bit integer).
+    Each map task has its own vocabulary; the driver merges them in a global one with merge.
+    """
+
+    def __init__(self, words=()):
+        self.words = []
+        self.ids = {}
+        for word in words:
+            self.id(word)
+
+    def id(self, word):
+        i = self.ids.get(word)
+        if i is None:
+            i = self.ids[word] = len(self.words)
+            self.words.append(word)
+        return i
+
+    def encoder(self, kind):
+        """Return a function encoding keys of the given kind as integers."""
+        id = self.id
+        if kind == 'word':
+            return id
+        if kind == 'pair':
+            return lambda pair: (id(pair[0]) << PAIR_SHIFT) | id(pair[1])
+        raise ValueError(f"unknown key kind {kind!r}")
+
+    def decoder(self, kind):
+        """Return a function decoding integers encoded by encoder(kind)."""
+        words = self.words
+        if kind == 'word':
+            return words.__getitem__
+        if kind == 'pair':
+            return lambda k: (words[k >> PAIR_SHIFT], words[k & PAIR_MASK])
+        raise ValueError(f"unknown key kind {kind!r}")
+
+    def merge(self, other):
+        """Add the words of other to this vocabulary; return a list mapping ids in other to ids in this one."""
+        return [self.id(word) for word in other.words]
+
+    def __getstate__(self):
+        return self.words  # ids can be rebuilt: no need to pickle them
+
+    def __setstate__(self, words):
+        self.__init__(words)
+
+
+def recode(keys, remap, kind):
+    """Translate an array of keys of the given kind with remap, the result of Vocabulary.merge."""
+    if kind == 'word':
+        return array('q', map(remap.__getitem__, keys))
+    return array('q', [(remap[k >> PAIR_SHIFT] << PAIR_SHIFT) | remap[k & PAIR_MASK] for k in keys])
+
+
+OUTPUT_BLOCK_SIZE = 1024  # pairs per block in output files
+PARTITION_PREFIX = 'part-'
+
+def write_partition(path, kvpairs):
+    """Write kvpairs, sorted by key, to path; return how many they are.
+
+    The file is a sequence of pickled blocks, each a (keys, values) pair of tuples, followed by a pickled index of
+    (first key, last key, offset) for each block, and by the offset of the index as an 8-byte integer.
+    """
+    kvpairs = sorted(kvpairs, key=first)
+    index = []
+    # written under a temporary name and then renamed, as duplicate reduce tasks may write the same partition
+    directory, name = os.path.split(path)
+    tmp_path = os.path.join(directory, f'.{name}.{os.getpid()}')
+    with open(tmp_path, 'wb') as f:
+        for block in chunked(kvpairs, OUTPUT_BLOCK_SIZE):
+            keys, values = zip(*block)
+            index.append((keys[0], keys[-1], f.tell()))
+            pickle.dump((keys, values), f, pickle.HIGHEST_PROTOCOL)
+        index_offset = f.tell()
+        pickle.dump(index, f, pickle.HIGHEST_PROTOCOL)
+        f.write(index_offset.to_bytes(8, 'little'))
+    os.replace(tmp_path, path)
+    return len(kvpairs)
+
+
+class PartitionedOutput:
+    """Reader for the output of MapReduce.save: a directory with a sorted file per reduce partition.
+
+    Only the block indexes are kept in memory: get and range only load the blocks that may contain the keys they
+    look for. Iterating yields all the pairs, merged in key order, so the output of a job can be the input of
+    another one.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.partitions = []  # (path, index, first keys of the blocks) for each file
+        for name in sorted(os.listdir(directory)):
+            if not name.startswith(PARTITION_PREFIX):
+                continue
+            path = os.path.join(directory, name)
+            with open(path, 'rb') as f:
+                f.seek(-8, io.SEEK_END)
+                f.seek(int.from_bytes(f.read(8), 'little'))
+                index = pickle.load(f)
+            self.partitions.append((path, index, [first_key for first_key, _, _ in index]))
+
+    @staticmethod
+    def read_block(f, offset):
+        f.seek(offset)
+        return pickle.load(f)
+
+    def get(self, key, default=None):
+        """Return the value for key, or default if it's not there."""
+        for path, index, first_keys in self.partitions:
+            i = bisect.bisect_right(first_keys, key) - 1  # the last block starting with a key <= key
+            if i < 0 or index[i][1] < key:
+                continue  # key is not in the range of any block
+            with open(path, 'rb') as f:
+                keys, values = self.read_block(f, index[i][2])
+            j = bisect.bisect_left(keys, key)
+            if j < len(keys) and keys[j] == key:
+                return values[j]
+        return default
+
+    def scan(self, partition, start=None, stop=None):
+        """Yield the pairs of a partition with start <= key < stop, in key order (None means unbounded)."""
+        path, index, first_keys = partition
+        i = 0 if start is None else max(bisect.bisect_left(first_keys, start) - 1, 0)
+        with open(path, 'rb') as f:
+            for _, last_key, offset in index[i:]:
+                if start is not None and last_key < start:
+                    continue
+                keys, values = self.read_block(f, offset)
+                for k, v in zip(keys, values):
+                    if stop is not None and not k < stop:
+                        return
+                    if start is None or not k < start:
+                        yield k, v
+
+    def range(self, start=None, stop=None):
+        """Yield the pairs with start <= key < stop from all partitions, in key order."""
+        return heapq.merge(*(self.scan(p, start, stop) for p in self.partitions), key=first)
+
+    def __iter__(self):
+        return self.range()
+
+    def __len__(self):
+        return sum(count for _, count in self.partition_sizes())
+
+    def partition_sizes(self):
+        for path, index, _ in self.partitions:
+            if not index:
+                yield path, 0
+                continue
+            with open(path, 'rb') as f:
+                keys, _ = self.read_block(f, index[-1][2])
+            yield path, (len(index) - 1) * OUTPUT_BLOCK_SIZE + len(keys)
+
+
+class InjectedFault(Exception):
+    pass
+
+
+class TaskFailed(Exception):
+    pass
+
+
+@dataclass
+class FaultInjection:
+    """Make tasks of parallel runs fail, straggle or crash their worker at random, to test retries and speculation.
+
+    Set a job's fault_injection to an instance; each task attempt draws its faults independently.
+    """
+
+    failure_rate: float = 0.0  # probability that a task raises InjectedFault
+    straggler_rate: float = 0.0  # probability that a task sleeps straggler_delay seconds before starting
+    straggler_delay: float = 5.0
+    crash_rate: float = 0.0  # probability that a task kills its worker process, so that its result never comes
+
+    def __call__(self):
+        if random.random() < self.crash_rate:
+            os._exit(1)
+        if random.random() < self.failure_rate:
+            raise InjectedFault(f"injected failure in process {os.getpid()}")
+        if random.random() < self.straggler_rate:
+            time.sleep(self.straggler_delay)
+
+
+TASK_POLL_INTERVAL = 0.05  # seconds between checks for stragglers
+
+
+class TaskAttempts:
+    """Bookkeeping for a task: its arguments, attempts started and still running, and start of the latest one."""
+
+    def __init__(self, args):
+        self.args = args
+        self.attempts = self.running = 0
+        self.started = None
+
+
+class TaskTracker:
+    """Run tasks on a pool, retrying failed ones and duplicating stragglers.
+
+    A failed task is resubmitted, up to max_attempts attempts in all; the pool hands it to whichever worker is
+    free, and replaces workers that died. A task whose latest attempt has been running for more than
+    speculation_factor times the median duration of the completed tasks (or task_timeout seconds, before any
+    completes) gets a speculative duplicate: the first attempt to complete wins, later ones are ignored. This also
+    recovers the tasks of crashed workers, whose results would never come; if all the attempts of a task run for
+    more than task_timeout seconds, they are presumed lost and a new one is started. At most max_pending tasks are
+    read from the input and in flight at once.
+    """
+
+    def __init__(self, pool, function, counters, max_attempts=4, speculation_factor=2.0, task_timeout=60.0,
+                 max_pending=None):
+        self.pool = pool
+        self.function = function
+        self.counters = counters
+        self.max_attempts = max_attempts
+        self.speculation_factor = speculation_factor
+        self.task_timeout = task_timeout
+        self.max_pending = max_pending or math.inf
+        self.done = queue.Queue()  # (index, start time, success, result or exception) of finished attempts
+        self.durations = []
+
+    def submit(self, index, task):
+        task.attempts += 1
+        task.running += 1
+        task.started = started = time.perf_counter()
+        done = self.done
+        self.pool.apply_async(self.function, task.args,
+                              callback=lambda result: done.put((index, started, True, result)),
+                              error_callback=lambda e: done.put((index, started, False, e)))
+
+    def speculate(self, running):
+        """Start a duplicate of stragglers, and a new attempt of tasks whose attempts all seem lost."""
+        if self.speculation_factor is None or not self.durations:
+            threshold = self.task_timeout
+        else:
+            durations = sorted(self.durations)
+            threshold = self.speculation_factor * durations[len(durations) // 2]
+        now = time.perf_counter()
+        for index, task in running.items():
+            elapsed = now - task.started
+            if elapsed > self.task_timeout or (task.running == 1 and elapsed > threshold):
+                if task.attempts >= self.max_attempts:
+                    if elapsed > self.task_timeout:
+                        raise TaskFailed(f"task {index} did not complete in {task.attempts} attempts")
+                    continue
+                self.counters['speculative_tasks'] += 1
+                self.submit(index, task)
+
+    def run(self, tasks):
+        """Run the function on each tuple of arguments in tasks; yield (index, result) pairs as tasks complete."""
+        tasks = enumerate(tasks)
+        running = {}  # index -> TaskAttempts, for uncompleted tasks
+        exhausted = False
+        while True:
+            while not exhausted and len(running) < self.max_pending:
+                item = next(tasks, None)
+                if item is None:
+                    exhausted = True
+                else:
+                    index, args = item
+                    running[index] = TaskAttempts(args)
+                    self.submit(index, running[index])
+            if not running:
+                return
+            try:
+                index, started, success, result = self.done.get(timeout=TASK_POLL_INTERVAL)
+            except queue.Empty:
+                self.speculate(running)
+                continue
+            task = running.get(index)
+            if task is None:
+                continue  # a late duplicate of a completed task
+            task.running -= 1
+            if success:
+                del running[index]
+                self.durations.append(time.perf_counter() - started)
+                yield index, result
+            elif task.attempts < self.max_attempts:
+                self.counters['failed_attempts'] += 1
+                self.submit(index, task)
+            elif not task.running:
+                raise TaskFailed(f"task {index} failed {task.attempts} times") from result
+
+
+CHECKSUM_BLOCK_SIZE = 1 << 20  # bytes of a file checksummed at once by incremental runs
+
+
+def checksum(mm, start, end, crc=0):
+    """Return the CRC-32 of mm[:end], given crc, that of mm[:start]; read a block at a time, not to copy it all."""
+    for pos in range(start, end, CHECKSUM_BLOCK_SIZE):
+        crc = zlib.crc32(mm[pos:min(pos + CHECKSUM_BLOCK_SIZE, end)], crc)
+    return crc
+
+
+def appended_lines(path, state):
+    """Return the end of the complete lines appended to path since the last run, and the new state of the file.
+
+    state is None for a new file, or what this returned on the last run: the offset consumed, the CRC-32 of the
+    bytes before it, and the size and modification time of the file. If these two are the same, the file wasn't
+    touched; otherwise, the CRC-32 of the consumed bytes is computed again, and if it doesn't match the file was not
+    only appended to, and we raise ValueError.
+    """
+    offset, crc, size, mtime = state or (0, 0, 0, None)
+    stat = os.stat(path)
+    if (stat.st_size, stat.st_mtime_ns) == (size, mtime):
+        return offset, state
+    if stat.st_size < offset:
+        raise ValueError(f"{path} shrank since the last run")
+    if stat.st_size == 0:
+        return 0, (0, 0, 0, stat.st_mtime_ns)  # empty files can't be memory-mapped
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if checksum(mm, 0, offset) != crc:
+            raise ValueError(f"{path} was modified before byte {offset}, consumed by the last run")
+        end = mm.rfind(b'\n', offset, stat.st_size) + 1 or offset
+        return end, (end, checksum(mm, offset, end, crc), stat.st_size, stat.st_mtime_ns)
+
+
+SPLITS_PER_WORKER = 4  # map tasks per worker when running on a MappedFile, to balance the load
+
 class MapReduce():
+    # how pairs are grouped by key: 'sort' (see sort_and_group), 'hash' (see hash_group) or 'external'
+    # (see external_sort_and_group)
+    grouping = 'sort'
+    sort_keys = False  # with 'hash' grouping, whether groups should still be returned ordered by key
+    spill_threshold = 1_000_000  # with 'external' grouping, the maximum number of pairs kept in memory
+    spill_dir = None  # where 'external' grouping writes its temporary files (None: the system default)
+    aggregator = None  # an Aggregator instance replacing combine and reduce, or None
+    # optional method receiving a list of batch_size records and returning an iterable of pairs; if defined, it's
+    # called instead of map
+    map_batch = None
+    batch_size = 1024
+    top_k = None  # if set, reduce tasks only return the top_k largest outputs according to top_key (see top)
+    top_key = second
+    output_dir = None  # if set, reduce tasks write their output there instead of returning it (see save)
+    # how parallel runs assign keys to reducers: 'hash', 'range' (ranges balanced on a sample of the map output) or
+    # 'salted' (hash, but spreading hot keys among several reducers); see sample_partitioner
+    partitioning = 'hash'
+    max_imbalance = 1.5  # with 'salted' partitioning, maximum load of a reducer relative to the average
+    # input records sampled from all the input and mapped by the driver to choose the partitioner; to sample them,
+    # the input is read before being sent to the map tasks, so it must fit in memory (unless it's a MappedFile)
+    skew_sample_size = 10_000
+    partitioner = None
+    prefetch = None  # if set, input batches of batch_size records read ahead by a background thread (see Prefetcher)
+    intern_keys = None  # None, or the kind of keys emitted by map ('word' or 'pair'), to encode them as integers
+    # parallel runs: attempts per task, and stragglers' running time (relative to the median task) after which they
+    # get a speculative duplicate, or None not to duplicate them (see TaskTracker)
+    max_attempts = 4
+    speculation_factor = 2.0
+    task_timeout = 60.0  # running time after which a task is duplicated, when no task has completed yet
+    fault_injection = None  # a FaultInjection, to test the above
+    instrument = False  # whether to record records and time of each phase in self.stats (see JobStats)
+    stats_path = None  # if set, self.stats is written there as JSON when the job completes
+
     def map(self, v):
         raise NotImplementedError
     
@@ -53,6 +941,10 @@ class MapReduce():
         raise NotImplementedError
     
     def apply_map(self, data):
+        if self.map_batch is not None:
+            for batch in chunked(data, self.batch_size):
+                yield from self.map_batch(batch)
+            return
         for elem in data:
             yield from self.map(elem)
     
@@ -60,28 +952,452 @@ class MapReduce():
         kvpairs = sorted(kvpairs, key=first)
         for k, g in groupby(kvpairs, key=first):
             yield k, map(second, g)  # note: not self.map, built-in function map
+
+    def hash_group(self, kvpairs, sort_keys=False):
+        """Group values in a dictionary of lists: no sorting of the pairs, just one append per pair.
+
+        Groups come out in order of first appearance of the key, unless sort_keys is true; then we only sort the
+        distinct keys, which are usually far fewer than the pairs.
+        """
+        groups = defaultdict(list)
+        for k, v in kvpairs:
+            groups[k].append(v)
+        if sort_keys:
+            return sorted(groups.items(), key=first)
+        return groups.items()
+
+    def external_sort_and_group(self, kvpairs):
+        """Like sort_and_group, but never holds more than self.spill_threshold pairs in memory.
+
+        Every time the buffer fills up, it is sorted and spilled to a temporary file as a sorted run. The runs (and
+        the last, partial buffer) are then merged lazily with heapq.merge, reading one block at a time from each.
+        Temporary files are deleted as soon as the groups are consumed.
+        """
+        kvpairs = iter(kvpairs)
+        with ExitStack() as stack:
+            runs = []
+            while True:
+                buffer = take(self.spill_threshold, kvpairs)
+                buffer.sort(key=first)
+                if len(buffer) < self.spill_threshold:  # input is over, the last run stays in memory
+                    break
+                f = stack.enter_context(tempfile.TemporaryFile(dir=self.spill_dir))
+                write_run(buffer, f)
+                self.counters['spilled_runs'] += 1
+                self.counters['spilled_bytes'] += f.seek(0, io.SEEK_END)
+                f.seek(0)
+                runs.append(read_run(f))
+            merged = heapq.merge(*runs, buffer, key=first)  # runs come first: values keep the input order
+            for k, g in groupby(merged, key=first):
+                yield k, map(second, g)
+
+    def group(self, kvpairs):
+        """Group kvpairs by key, with the strategy chosen by self.grouping."""
+        if self.grouping == 'hash':
+            return self.hash_group(kvpairs, self.sort_keys)
+        if self.grouping == 'sort':
+            return self.sort_and_group(kvpairs)
+        if self.grouping == 'external':
+            return self.external_sort_and_group(kvpairs)
+        raise ValueError(f"unknown grouping strategy {self.grouping!r}")
     
     def apply_reduce(self, groups):
         for k, values in groups:
             yield from self.reduce(k, values)
 
-    def run(self, data):
-        kvpairs = self.apply_map(data)
-        groups = self.sort_and_group(kvpairs)
-        return self.apply_reduce(groups)
+    def apply_aggregate_combine(self, kvpairs):
+        """Combine phase for jobs with an aggregator: one partial aggregate per key."""
+        n_in = count()
+        partials = self.aggregator.combine(map(first, zip(kvpairs, n_in)))  # counts pairs without a Python loop
+        self.counters['combine_in'] += next(n_in)
+        self.counters['combine_out'] += len(partials)
+        yield from partials.items()
+
+    def apply_aggregate_merge(self, kvpartials):
+        """Shuffle phase for jobs with an aggregator: yield each key with the merge of its partial aggregates."""
+        aggregator = self.aggregator
+        if self.grouping == 'hash':  # merge everything in a single dictionary, no grouping needed
+            partials = aggregator.merge(kvpartials).items()
+            if self.sort_keys:
+                partials = sorted(partials, key=first)
+            yield from partials
+        else:
+            merge_values = aggregator.merge_values
+            for k, values in self.group(kvpartials):
+                yield k, merge_values(values)
+
+    def apply_finalize(self, partials):
+        """Reduce phase for jobs with an aggregator."""
+        finalize = self.aggregator.finalize
+        for k, aggregate in partials:
+            yield k, finalize(aggregate)
+
+    def metered(self, phase, iterable, batch_size=METER_BATCH_SIZE):
+        """Return iterable, the output of phase, wrapped to record statistics about it if self.instrument is set."""
+        if not self.instrument:
+            return iterable
+        return meter(iterable, self.stats.phase(phase), batch_size)
+
+    def apply_encode(self, kvpairs):
+        encode = self.vocabulary.encoder(self.intern_keys)
+        for k, v in kvpairs:
+            yield encode(k), v
+
+    def apply_decode(self, kvpairs):
+        decode = self.vocabulary.decoder(self.intern_keys)
+        for k, v in kvpairs:
+            yield decode(k), v
+
+    def mapped(self, data):
+        """Map output for data, with keys encoded in self.vocabulary if self.intern_keys is set."""
+        if self.prefetch is not None:
+            data = Prefetcher(data, self.batch_size, self.prefetch)
+        kvpairs = self.apply_map(self.metered('input', data))
+        if self.intern_keys is not None:
+            kvpairs = self.apply_encode(kvpairs)
+        return self.metered('map', kvpairs)
+
+    def map_phase(self, data):
+        """Everything that happens before the shuffle: reading input, map and, in subclasses, combine.
+
+        With an aggregator, the map output is always combined to one partial aggregate per key.
+        """
+        kvpairs = self.mapped(data)
+        if self.aggregator is not None:
+            return self.metered('combine', self.apply_aggregate_combine(kvpairs))
+        return kvpairs
+
+    def reduce_phase(self, kvpairs):
+        """Everything that happens after the map phase: grouping (the 'shuffle' phase) and reduce."""
+        if self.aggregator is not None:
+            partials = self.metered('shuffle', self.apply_aggregate_merge(kvpairs))
+            return self.metered('reduce', self.apply_finalize(partials))
+        groups = self.metered('shuffle', self.group(kvpairs), batch_size=1)  # groupby values can't be read ahead
+        return self.metered('reduce', self.apply_reduce(groups))
+
+    def combine_ratio(self):
+        """Reduction ratio of the combiner in the last run: pairs it received per pair it emitted."""
+        return self.stats.combine_ratio()
+
+    def new_stats(self):
+        self.stats = JobStats()
+        self.counters = self.stats.counters
+
+    def map_task(self, chunk, n_partitions):
+        """Run the map phase on a chunk of the input, splitting the output in one list per reducer.
+
+        The task's statistics are sent back together with the partitions, to be summed up by the driver.
+        """
+        if self.fault_injection is not None:
+            self.fault_injection()
+        self.new_stats()
+        if self.intern_keys is not None:
+            return self.interned_map_task(chunk, n_partitions)
+        partitions = [[] for _ in range(n_partitions)]
+        partitioner = self.partitioner
+        for k, v in self.map_phase(chunk):
+            partitions[partitioner(k)].append((k, v))
+        self.stats.finish()
+        return partitions, self.stats
+
+    def interned_map_task(self, chunk, n_partitions):
+        """map_task for jobs with interned keys.
+
+        Partitions are (keys, values) pairs, with keys in an array of integers, and the task's vocabulary is also
+        sent back. Keys are partitioned by their (first) word, so that the same key ends up in the same partition
+        whatever its id in each task.
+        """
+        self.vocabulary = vocabulary = Vocabulary()
+        words = vocabulary.words
+        word_partitions = []  # partition of each word id, computed once per word
+        shift = PAIR_SHIFT if self.intern_keys == 'pair' else 0
+        partitions = [(array('q'), []) for _ in range(n_partitions)]
+        for k, v in self.map_phase(chunk):
+            i = k >> shift
+            while len(word_partitions) <= i:
+                word_partitions.append(partition(words[len(word_partitions)], n_partitions))
+            keys, values = partitions[word_partitions[i]]
+            keys.append(k)
+            values.append(v)
+        self.stats.finish()
+        return (partitions, vocabulary), self.stats
+
+    def reduce_task(self, kvpairs, index, vocabulary=None):
+        """Group and reduce all the pairs of the index-th partition. The result is a list, so that it can be sent back.
+
+        With interned keys, kvpairs is a (keys, values) pair and vocabulary, merged by the driver, decodes the keys.
+        """
+        if self.fault_injection is not None:
+            self.fault_injection()
+        self.new_stats()
+        if self.intern_keys is not None:
+            kvpairs = zip(*kvpairs)
+            self.vocabulary = vocabulary
+        hot_partials = []
+        hot_keys = getattr(self.partitioner, 'hot_keys', None)
+        if hot_keys:
+            hot_partials = [kv for kv in kvpairs if kv[0] in hot_keys]
+            kvpairs = [kv for kv in kvpairs if kv[0] not in hot_keys]
+            if self.aggregator is not None or isinstance(self, MapReduceCombine):
+                hot_partials = list(self.partial_reduce(hot_partials))
+            # else, the values of hot keys are sent back as they are, and only reduced by merge_hot_keys
+        output = self.reduce_phase(kvpairs)
+        if self.intern_keys is not None:
+            output = self.apply_decode(output)
+        if self.top_k is not None:
+            output = heapq.nlargest(self.top_k, output, key=self.top_key)
+        elif self.output_dir is not None:
+            write_partition(self.partition_path(index), output)
+            output = []
+        else:
+            output = list(output)
+        self.stats.finish()
+        return output, hot_partials, self.stats
+
+    def partial_reduce(self, kvpairs):
+        """Reduce map output or partial results only partially, so that they can be merged again later.
+
+        Used for hot keys in 'salted' partitioning, and by run_incremental.
+        """
+        if self.aggregator is not None:
+            return self.aggregator.merge(kvpairs).items()
+        if not isinstance(self, MapReduceCombine):
+            raise ValueError("partial results need an aggregator or a combiner")
+        return (kv for k, values in self.group(kvpairs) for kv in self.combine(k, values))
+
+    def merge_hot_keys(self, partials):
+        """Second stage of 'salted' partitioning: reduce the partial results for hot keys of all reducers.
+
+        For jobs without an aggregator or a combiner, partials are the map output for hot keys.
+        """
+        if self.aggregator is not None:
+            return list(self.apply_finalize(self.aggregator.merge(partials).items()))
+        return list(self.apply_reduce(self.group(partials)))
+
+    def partition_path(self, index):
+        return os.path.join(self.output_dir, f'{PARTITION_PREFIX}{index:05}')
+
+    def run(self, data, workers=None, chunk_size=4096):
+        """Run the job on data. If workers is given, use that many processes (see run_parallel).
+
+        data is an iterable of records, or a MappedFile.
+
+        Statistics about the run are collected in self.stats (see JobStats), which is complete once the output is
+        consumed.
+        """
+        self.new_stats()
+        self.vocabulary = Vocabulary()
+        if workers is not None:
+            return self.run_parallel(data, workers, chunk_size)
+        kvpairs = self.map_phase(data)
+        output = self.reduce_phase(kvpairs)
+        if self.intern_keys is not None:
+            output = self.apply_decode(output)
+        return self.completed(output)
+
+    def completed(self, output):
+        """Yield the output of a serial run, then finalize statistics."""
+        start = time.perf_counter()
+        yield from output
+        self.stats.wall_time = time.perf_counter() - start
+        self.stats.finish()
+        if self.stats_path is not None:
+            self.stats.dump(self.stats_path)
+
+    def top(self, data, k, key=second, **run_args):
+        """Run the job and return its k largest outputs according to key, in descending order.
+
+        Each reduce task keeps only its own top k outputs in a bounded heap, so parallel runs only send k outputs
+        per partition back to the driver. The other arguments are passed to run; for parallel runs, key must be
+        picklable (e.g., an operator.itemgetter rather than a lambda).
+        """
+        self.top_k, self.top_key = k, key
+        try:
+            return heapq.nlargest(k, self.run(data, **run_args), key=key)
+        finally:
+            del self.top_k, self.top_key  # back to the class defaults
+
+    def save(self, data, directory, **run_args):
+        """Run the job, writing its output in directory, and return a PartitionedOutput to read it.
+
+        Every reduce task writes a file with its output sorted by key (a single one for serial runs), so output keys
+        must be comparable. Existing output files in directory are removed. The other arguments are passed to run.
+        """
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            if name.startswith(PARTITION_PREFIX):
+                os.remove(os.path.join(directory, name))
+        self.output_dir = directory
+        try:
+            output = self.run(data, **run_args)
+            if run_args.get('workers') is None:
+                write_partition(self.partition_path(0), output)
+        finally:
+            del self.output_dir
+        return PartitionedOutput(directory)
+
+    def run_incremental(self, paths, state_path, encoding='utf-8'):
+        """Run the job on the text files in paths, only reading what was appended to them since the previous run.
+
+        state_path stores, between runs, the partial aggregate of each key (see partial_reduce) and the offset
+        consumed in each file: the lines appended since then are mapped, and their partial aggregates merged with
+        the stored ones. The output is the same as that of run on the whole files, so the job needs an aggregator
+        or a combiner. A last line without a newline is left for the next run, as it may still be being written.
+        Files that changed are read whole to check that the consumed part is the same (see appended_lines).
+        """
+        if self.intern_keys is not None:
+            raise ValueError("incremental runs don't support interned keys")
+        self.new_stats()
+        try:
+            with open(state_path, 'rb') as f:
+                files, partials = pickle.load(f)  # path -> state (see appended_lines); key -> partial aggregate
+        except FileNotFoundError:
+            files, partials = {}, {}
+        appended = []
+        for path in paths:
+            state = files.get(path)
+            end, files[path] = appended_lines(path, state)
+            appended.append(MappedFile(path, state[0] if state else 0, end, encoding))
+        partials = dict(self.partial_reduce(chain(partials.items(), self.map_phase(chain.from_iterable(appended)))))
+        tmp_path = f'{state_path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((files, partials), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, state_path)  # never leave a half-written state
+        return self.completed(self.reduce_phase(partials.items()))
+
+    def run_parallel(self, data, workers, chunk_size=4096, pool=None):
+        """Run the job on a pool of worker processes.
+
+        The input is split in chunks of chunk_size elements (or, for a MappedFile, in SPLITS_PER_WORKER line-aligned
+        byte ranges per worker); each chunk is mapped (and combined) by a worker, which partitions its output by key
+        among `workers` reducers. Then each partition is reduced in parallel.
+        The result contains the same pairs as run(data), ordered by partition rather than globally by key.
+        Failed tasks are retried and stragglers duplicated (see TaskTracker); the counters 'failed_attempts' and
+        'speculative_tasks' in self.stats report how often.
+        Tasks run on a new multiprocessing.Pool of `workers` processes, unless another object with its apply_async
+        method is given as pool (e.g., a cluster.ClusterPool).
+        """
+        start = time.perf_counter()
+        # not self.stats and self.vocabulary: self is pickled for the workers while we update these
+        stats, vocabulary = JobStats(), Vocabulary()
+        with ExitStack() as stack:
+            if pool is None:
+                pool = stack.enter_context(multiprocessing.Pool(workers))
+            map_task = partial(self.map_task, n_partitions=workers)
+            if isinstance(data, MappedFile):
+                chunks = data.split(workers * SPLITS_PER_WORKER)
+            else:
+                chunks = chunked(data, chunk_size)
+            self.partitioner = HashPartitioner(workers)
+            if self.partitioning != 'hash':
+                if self.intern_keys is not None:
+                    raise ValueError("interned keys only support 'hash' partitioning")
+                chunks = list(chunks)  # read twice: for the sample, and by the map tasks
+                sample = reservoir_sample(chain.from_iterable(chunks), self.skew_sample_size,
+                                          random.Random(0))  # seeded: the same input gets the same partitioner
+                sample = Counter(map(first, self.map_phase(sample)))
+                self.partitioner = sample_partitioner(sample, workers, self.partitioning, self.max_imbalance)
+            if self.intern_keys is not None:
+                partitions = [(array('q'), []) for _ in range(workers)]
+            else:
+                partitions = [[] for _ in range(workers)]
+            tracker = partial(TaskTracker, pool, counters=stats.counters, max_attempts=self.max_attempts,
+                              speculation_factor=self.speculation_factor, task_timeout=self.task_timeout)
+            map_tracker = tracker(map_task, max_pending=2 * workers)  # don't read the input much ahead of the workers
+            for _, (task_output, task_stats) in map_tracker.run((chunk,) for chunk in chunks):
+                if self.intern_keys is not None:
+                    task_output, task_vocabulary = task_output
+                    remap = vocabulary.merge(task_vocabulary)
+                    for (keys, values), (task_keys, task_values) in zip(partitions, task_output):
+                        keys.extend(recode(task_keys, remap, self.intern_keys))
+                        values.extend(task_values)
+                else:
+                    for kvpairs, task_kvpairs in zip(partitions, task_output):
+                        kvpairs.extend(task_kvpairs)
+                stats.merge(task_stats)
+            stats.partition_records = [len(kvpairs) for kvpairs in partitions]
+            outputs, hot_partials = [None] * workers, []
+            reduce_tracker = tracker(partial(self.reduce_task, vocabulary=vocabulary))
+            for index, (task_output, task_hot_partials, task_stats) in reduce_tracker.run(
+                    zip(partitions, range(workers))):
+                outputs[index] = task_output
+                hot_partials.extend(task_hot_partials)
+                stats.merge(task_stats)
+        if hot_partials:
+            outputs.append(self.merge_hot_keys(hot_partials))
+            if self.output_dir is not None:
+                write_partition(self.partition_path(workers), outputs.pop())
+        stats.wall_time = time.perf_counter() - start
+        self.stats, self.counters, self.vocabulary = stats, stats.counters, vocabulary
+        if self.stats_path is not None:
+            stats.dump(self.stats_path)
+        return chain.from_iterable(outputs)
 
     
+IN_MAPPER_FOLD_SIZE = 64  # in-mapper combining folds the values of a key once this many are buffered
+
 class MapReduceCombine(MapReduce):
+    combine_size = 1024
+    # 'chunk': combine each chunk of combine_size pairs (see apply_combine);
+    # 'in-mapper': keep a bounded dictionary of partial aggregates (see apply_in_mapper_combine)
+    combining = 'chunk'
+    in_mapper_keys = 10_000  # maximum number of keys buffered by in-mapper combining
+
     def combine(self, k, values):
         raise NotImplementedError
         
     def apply_combine(self, kvpairs, combine_size):
+        counters = self.counters
         for kvchunk in chunked(kvpairs, combine_size):
-            for k, values in self.sort_and_group(kvchunk):
-                yield from self.combine(k, values)
+            counters['combine_in'] += len(kvchunk)
+            for k, values in self.group(kvchunk):
+                for kv in self.combine(k, values):
+                    counters['combine_out'] += 1
+                    yield kv
+
+    def apply_in_mapper_combine(self, kvpairs, max_keys):
+        """Combine map output in a dictionary of partial aggregates holding at most max_keys keys.
+
+        Pending values of a key are folded with self.combine every IN_MAPPER_FOLD_SIZE values. When a new key
+        doesn't fit, the least recently used key is flushed to the shuffle; the rest is flushed at the end.
+        As for any combiner, self.combine must yield pairs with the same key it receives.
+        """
+        counters = self.counters
+        buffer = OrderedDict()  # key -> pending values, least recently used first
+        n_in = n_out = 0
+        for k, v in kvpairs:
+            n_in += 1
+            values = buffer.get(k)
+            if values is None:
+                if len(buffer) >= max_keys:
+                    old_k, old_values = buffer.popitem(last=False)
+                    for kv in self.combine(old_k, old_values):
+                        n_out += 1
+                        yield kv
+                buffer[k] = [v]
+                continue
+            buffer.move_to_end(k)
+            values.append(v)
+            if len(values) >= IN_MAPPER_FOLD_SIZE:
+                values[:] = map(second, self.combine(k, values))
+        for k, values in buffer.items():
+            for kv in self.combine(k, values):
+                n_out += 1
+                yield kv
+        counters['combine_in'] += n_in
+        counters['combine_out'] += n_out
+
+    def map_phase(self, data):
+        if self.aggregator is not None:
+            return super().map_phase(data)
+        kvpairs = self.mapped(data)
+        if self.combining == 'in-mapper':
+            return self.metered('combine', self.apply_in_mapper_combine(kvpairs, self.in_mapper_keys))
+        if self.combining == 'chunk':
+            return self.metered('combine', self.apply_combine(kvpairs, self.combine_size))
+        raise ValueError(f"unknown combining strategy {self.combining!r}")
     
-    def run(self, data, combine_size=1024):
-        kvpairs = self.apply_map(data)
-        kvpairs = self.apply_combine(kvpairs, combine_size)
-        groups = self.sort_and_group(kvpairs)
-        return self.apply_reduce(groups)
+    def run(self, data, combine_size=None, workers=None, chunk_size=4096):
+        if combine_size is not None:  # else, the combine_size of the class (or of the instance) is used
+            self.combine_size = combine_size  # stored in self, so that it also reaches worker processes
+        return super().run(data, workers, chunk_size)
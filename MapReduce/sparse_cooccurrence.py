@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+import simplemr
+from cooccurrence import STOPWORDS, WORD_RE
+
+
+class SparseCoOccurrence:
+    """Same result as PairCoOccurrence and StripesCoOccurrence, computed with NumPy on blocks of lines.
+
+    Words are interned in a simplemr.Vocabulary; for each block, the ids of all its words go in one array, and the
+    co-occurring pairs at distance d are obtained by comparing the array with itself shifted by d (keeping only words
+    on the same line). Pairs are packed as (smaller id << 32) | larger id, and counted in a sparse matrix in COO
+    format: an array of distinct packed pairs, and an array with their counts.
+    """
+
+    block_size = 4096  # lines processed together
+
+    def __init__(self, window):
+        self.window = window
+
+    def block_pairs(self, lines, vocabulary):
+        """Return the distinct packed pairs in lines, and how many times each of them occurs."""
+        word_id = vocabulary.id
+        tokens, line_numbers = [], []
+        for n, line in enumerate(lines):
+            ids = [word_id(w) for w in WORD_RE.findall(line.lower()) if w not in STOPWORDS]
+            tokens.extend(ids)
+            line_numbers.extend([n] * len(ids))
+        tokens = np.array(tokens, dtype=np.int64)
+        line_numbers = np.array(line_numbers, dtype=np.int64)
+        pairs = [np.empty(0, dtype=np.int64)]
+        for d in range(1, self.window):
+            same_line = line_numbers[:-d] == line_numbers[d:]
+            a, b = tokens[:-d][same_line], tokens[d:][same_line]
+            pairs.append((np.minimum(a, b) << simplemr.PAIR_SHIFT) | np.maximum(a, b))
+        return np.unique(np.concatenate(pairs), return_counts=True)
+
+    def matrix(self, data):
+        """Count co-occurrences in data, returning the COO matrix (pairs, counts) and the vocabulary."""
+        vocabulary = simplemr.Vocabulary()
+        block_pairs, block_counts = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+        for lines in simplemr.chunked(data, self.block_size):
+            pairs, counts = self.block_pairs(lines, vocabulary)
+            block_pairs.append(pairs)
+            block_counts.append(counts)
+        # sum the counts of duplicate entries, as in scipy.sparse's COO to CSR conversion
+        pairs, positions = np.unique(np.concatenate(block_pairs), return_inverse=True)
+        counts = np.bincount(positions, weights=np.concatenate(block_counts)).astype(np.int64)
+        return pairs, counts, vocabulary
+
+    def decode(self, pairs, counts, vocabulary):
+        words = vocabulary.words
+        for k, count in zip(pairs.tolist(), counts.tolist()):
+            w1, w2 = words[k >> simplemr.PAIR_SHIFT], words[k & simplemr.PAIR_MASK]
+            yield ((w1, w2) if w1 < w2 else (w2, w1)), count  # same order as in PairCoOccurrence
+
+    def run(self, data):
+        return self.decode(*self.matrix(data))
+
+    def top(self, data, k):
+        """The k most frequent pairs, selecting them with NumPy and decoding only those."""
+        pairs, counts, vocabulary = self.matrix(data)
+        best = np.argsort(-counts, kind='stable')[:k]
+        return list(self.decode(pairs[best], counts[best], vocabulary))
+
+
+if __name__ == '__main__':
+    print("Sparse")
+    with open('mobydick.txt') as f:
+        print(SparseCoOccurrence(4).top(f, 10))
@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 
-import heapq
+import collections
+import os
 import re
+import tempfile
 
 import simplemr
 
@@ -23,17 +25,65 @@ class WordCount(simplemr.MapReduce):
 class WordCountCombine(WordCount, simplemr.MapReduceCombine):
     def combine(self, key, values):
         yield key, sum(values)
+
+
+class WordCountInMapper(WordCountCombine):
+    combining = 'in-mapper'  # one pair per distinct word, unless more than in_mapper_keys words are buffered
+
+
+class WordCountBatch(WordCount):
+    def map_batch(self, lines):
+        """Tokenize a whole batch of lines at once, emitting a single pair per distinct word."""
+        counts = collections.Counter(WORD_RE.findall('\n'.join(lines).lower()))
+        return ((w, c) for w, c in counts.items() if w not in STOPWORDS)
+
+
+class WordCountAggregate(WordCount):
+    aggregator = simplemr.Sum()  # used as both combiner and reducer
         
         
 if __name__ == '__main__':
 
     print("Wordcount without combiner")
     with open('mobydick.txt') as f:
-        output = WordCount().run(f)
-        #It extracts the 10 most frequent words based on the second element of the tuples (count) using simplemr.second as the key.
-        print(heapq.nlargest(10, output, key=simplemr.second))
+        print(WordCount().top(f, 10))
 
     print("Wordcount with combiner")
     with open('mobydick.txt') as f:
-        output = WordCountCombine().run(f)
-        print(heapq.nlargest(10, output, key=simplemr.second))
+        job = WordCountCombine()
+        print(job.top(f, 10))
+        print(f"Combiner reduction ratio: {job.combine_ratio():.2f}")
+
+    print("Wordcount with in-mapper combining")
+    with open('mobydick.txt') as f:
+        job = WordCountInMapper()
+        print(job.top(f, 10))
+        print(f"Combiner reduction ratio: {job.combine_ratio():.2f}")
+
+    print("Wordcount with batched map")
+    with open('mobydick.txt') as f:
+        print(WordCountBatch().top(f, 10))
+
+    print("Wordcount with a declarative aggregator")
+    with open('mobydick.txt') as f:
+        print(WordCountAggregate().top(f, 10))
+
+    print("Wordcount with combiner, in parallel")
+    with open('mobydick.txt') as f:
+        print(WordCountCombine().top(f, 10, workers=os.cpu_count()))
+
+    print("Wordcount with combiner, in parallel on a memory-mapped file")
+    print(WordCountCombine().top(simplemr.MappedFile('mobydick.txt'), 10, workers=os.cpu_count()))
+
+    print("Incremental wordcount, on a file growing in two steps")
+    with open('mobydick.txt', 'rb') as f:
+        lines = f.readlines()
+    with tempfile.TemporaryDirectory() as tmp:
+        path, state_path = os.path.join(tmp, 'corpus.txt'), os.path.join(tmp, 'state')
+        with open(path, 'wb') as f:
+            f.writelines(lines[:len(lines) // 2])
+        WordCountAggregate().run_incremental([path], state_path)
+        with open(path, 'ab') as f:
+            f.writelines(lines[len(lines) // 2:])
+        output = WordCountAggregate().run_incremental([path], state_path)  # only maps the second half
+        print(sorted(output, key=simplemr.second, reverse=True)[:10])
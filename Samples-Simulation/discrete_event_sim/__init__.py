@@ -0,0 +1,13 @@
+"""The discrete event simulation kernel shared by the simulations in queue_sim and p2p_backup.
+
+Subclass Simulation and Event (see core.py); the event queue implementations are in queues.py, and the statistics
+collected by profiled runs in profiling.py.
+
+The simulation scripts are run from their own folders (queue_sim, p2p_backup), where this package can't be found:
+each of them adds the parent folder to sys.path before importing it, with the same single line. A helper for that
+would have to live outside the package, and be found in the same way.
+"""
+
+from .core import Event, ScheduledEvent, Simulation
+from .profiling import EventClassStats, SimulationStats
+from .queues import EVENT_QUEUES, CalendarQueue, HeapQueue, LadderQueue
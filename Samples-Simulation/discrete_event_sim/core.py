@@ -0,0 +1,169 @@
+import logging
+import time
+from itertools import count
+
+from .profiling import SimulationStats
+from .queues import EVENT_QUEUES
+
+
+class ScheduledEvent:
+    """The handle returned by Simulation.schedule: call cancel() to drop the event before it happens.
+
+    Canceling is O(1): the handle is only marked, and skipped when it is popped; the simulation removes canceled
+    handles from the queue all at once when they become too many. Handles are marked as done when popped: canceling
+    them then does nothing, as they're not in the queue anymore.
+    """
+
+    __slots__ = ('event', 'sim', 'canceled', 'done')
+
+    def __init__(self, event, sim):
+        self.event = event
+        self.sim = sim
+        self.canceled = False
+        self.done = False
+
+    def cancel(self):
+        if not (self.canceled or self.done):
+            self.canceled = True
+            self.sim.event_canceled()
+
+
+def is_live(entry):
+    return not entry[3].canceled
+
+
+class Simulation:
+    """Subclass this to represent the simulation state.
+
+    Here, self.t is the simulated time and self.events is the event queue. Its entries are
+    (time, priority, sequence number, ScheduledEvent) tuples: events at the same time are processed by increasing
+    priority, and then in the order they were scheduled. As sequence numbers are unique, comparing entries never
+    reaches the ScheduledEvent (nor calls Python methods), and the order of events depends only on the simulation
+    itself, so that runs with the same random seed are exactly reproducible.
+
+    self.canceled counts the canceled events still in the queue: when they are more than a `compact_ratio` fraction
+    of it (and at least `compact_min`), they are removed, so that memory and the cost of popping stay proportional to
+    the live events.
+
+    Set profile = True (on the class or an instance) to collect statistics about the runs in self.stats (see
+    SimulationStats): they're gathered by a separate loop in run, so there's no cost when profiling is disabled.
+    """
+
+    compact_ratio = 0.5
+    compact_min = 1024
+    profile = False
+
+    def __init__(self, event_queue='heap'):
+        """Extend this method with the needed initialization.
+
+        You can call super().__init__() there to call the code here. event_queue is the name of the event queue
+        implementation to use, among those in EVENT_QUEUES.
+        """
+
+        self.t = 0  # simulated time
+        self.events = EVENT_QUEUES[event_queue]()
+        self.canceled = 0  # canceled events still in the queue
+        self.next_sequence = count().__next__  # to break ties between events with the same time and priority
+        self.stats = SimulationStats()
+
+    def schedule(self, delay, event, priority=None):
+        """Add an event to the event queue after the required delay; return a handle to cancel it.
+
+        If priority is not given, event.priority is used.
+        """
+
+        scheduled = ScheduledEvent(event, self)
+        if priority is None:
+            priority = event.priority
+        self.events.push((self.t + delay, priority, self.next_sequence(), scheduled))
+        return scheduled
+
+    def event_canceled(self):
+        """Called by ScheduledEvent.cancel: compact the event queue if it's full of canceled events."""
+
+        self.canceled += 1
+        if self.canceled >= self.compact_min and self.canceled > self.compact_ratio * len(self.events):
+            self.events.compact(is_live)
+            self.canceled = 0
+
+    def run(self, max_t=float('inf')):
+        """Run the simulation. If max_t is specified, stop it at that time."""
+
+        if self.profile:
+            return self.run_profiled(max_t)
+        pop = self.events.pop  # looked up once, rather than for every event
+        now = None
+        while True:
+            try:
+                t, _, _, scheduled = pop()  # get the first event from the queue
+            except IndexError:  # the event queue is empty
+                break
+            if scheduled.canceled:
+                self.canceled -= 1
+                continue
+            scheduled.done = True
+            if t != now:  # events with the same timestamp are processed as a batch, checking and setting time once
+                if t > max_t:
+                    break
+                self.t = now = t
+            scheduled.event.process(self)
+
+    def run_profiled(self, max_t):
+        """Like run, but timing each event and sampling the event queue size in self.stats."""
+
+        stats = self.stats
+        events = self.events
+        pop = events.pop
+        clock = time.perf_counter
+        event_classes = {}  # event class -> EventClassStats, cached here for speed
+        sample_interval = stats.queue_sample_interval
+        processed = 0
+        start_t, start = self.t, clock()
+        now = None
+        while True:
+            try:
+                t, _, _, scheduled = pop()
+            except IndexError:
+                break
+            if scheduled.canceled:
+                self.canceled -= 1
+                stats.canceled += 1
+                continue
+            scheduled.done = True
+            if t != now:
+                if t > max_t:
+                    break
+                self.t = now = t
+            event = scheduled.event
+            cls = type(event)
+            cls_stats = event_classes.get(cls)
+            if cls_stats is None:
+                cls_stats = event_classes[cls] = stats.event_class(cls)
+            before = clock()
+            event.process(self)
+            cls_stats.time += clock() - before
+            cls_stats.count += 1
+            processed += 1
+            if processed % sample_interval == 0:
+                stats.queue_sizes.append((now, len(events)))
+        stats.events += processed
+        stats.wall_time += clock() - start
+        stats.simulated_time += self.t - start_t
+
+    def log_info(self, msg):
+        logging.info(f'{self.t:.2f}: {msg}')
+
+
+class Event:
+    """
+    Subclass this to represent your events.
+
+    You may need to define __init__ to set up all the necessary information. Override priority (a number, lower
+    values first) to process events of a class before or after others happening at the same time.
+    """
+
+    __slots__ = ()  # subclasses should define __slots__ too (or use @dataclass(slots=True)), or they get a __dict__
+    priority = 0
+
+    def process(self, sim: Simulation):
+        raise NotImplementedError
@@ -0,0 +1,77 @@
+import json
+from dataclasses import dataclass
+
+QUEUE_SAMPLE_INTERVAL = 1000  # events processed between two samples of the event queue size
+
+
+@dataclass
+class EventClassStats:
+    """Events of a class processed, and wall time spent in their process method."""
+
+    count: int = 0
+    time: float = 0.0
+
+    def mean_time(self):
+        return self.time / self.count if self.count else 0.0
+
+
+class SimulationStats:
+    """Statistics of the runs of a simulation with profile = True, available as sim.stats.
+
+    event_classes maps each event class to its EventClassStats; queue_sizes is a list of (simulated time, pending
+    events) pairs, sampled every queue_sample_interval events. canceled counts the canceled events skipped.
+    """
+
+    def __init__(self, queue_sample_interval=QUEUE_SAMPLE_INTERVAL):
+        self.event_classes = {}
+        self.queue_sizes = []
+        self.queue_sample_interval = queue_sample_interval
+        self.events = 0
+        self.canceled = 0
+        self.wall_time = 0.0
+        self.simulated_time = 0.0
+
+    def event_class(self, cls):
+        stats = self.event_classes.get(cls)
+        if stats is None:
+            stats = self.event_classes[cls] = EventClassStats()
+        return stats
+
+    def events_per_simulated_second(self):
+        return self.events / self.simulated_time if self.simulated_time else 0.0
+
+    def as_dict(self):
+        total = sum(stats.time for stats in self.event_classes.values())
+        event_classes = {}
+        for cls, stats in sorted(self.event_classes.items(), key=lambda item: -item[1].time):
+            event_classes[cls.__name__] = {'count': stats.count,
+                                           'time': stats.time,
+                                           'mean_time': stats.mean_time(),
+                                           'time_share': stats.time / total if total else 0.0}
+        return {'events': self.events,
+                'canceled': self.canceled,
+                'wall_time': self.wall_time,
+                'simulated_time': self.simulated_time,
+                'events_per_second': self.events / self.wall_time if self.wall_time else 0.0,
+                'events_per_simulated_second': self.events_per_simulated_second(),
+                'max_queue_size': max((size for _, size in self.queue_sizes), default=0),
+                'event_classes': event_classes,
+                'queue_sizes': self.queue_sizes}
+
+    def dump(self, path):
+        """Write the statistics to path as JSON."""
+        with open(path, 'w') as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+    def table(self):
+        """The statistics as a human-readable table, slowest event classes first."""
+        stats = self.as_dict()
+        lines = [f"{'event class':<24} {'count':>12} {'time (s)':>10} {'mean (us)':>10} {'share':>7}"]
+        for name, cls_stats in stats['event_classes'].items():
+            lines.append(f"{name:<24} {cls_stats['count']:>12,} {cls_stats['time']:>10.3f} "
+                         f"{cls_stats['mean_time'] * 1e6:>10.2f} {cls_stats['time_share']:>7.1%}")
+        lines.append(f"{stats['events']:,} events ({stats['canceled']:,} canceled skipped) in "
+                     f"{stats['wall_time']:.3f}s: {stats['events_per_second']:,.0f} per second, "
+                     f"{stats['events_per_simulated_second']:,.4g} per simulated second; "
+                     f"up to {stats['max_queue_size']:,} pending events")
+        return '\n'.join(lines)
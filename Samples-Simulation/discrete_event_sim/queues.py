@@ -0,0 +1,233 @@
+import bisect
+import heapq
+import math
+from functools import partial
+from itertools import chain
+
+# Event queues: priority queues of entries, tuples whose first element is the event time, with push(entry), pop()
+# returning the smallest entry, compact(keep) dropping the entries for which keep(entry) is false, and len().
+# Simulation uses a HeapQueue unless told otherwise (see EVENT_QUEUES).
+
+
+class HeapQueue:
+    """A binary heap (see https://docs.python.org/dev/library/heapq.html): O(log n) per operation."""
+
+    def __init__(self):
+        self.heap = []
+        # bound to the heap list, so that pushing and popping don't run any Python code
+        self.push = partial(heapq.heappush, self.heap)
+        self.pop = partial(heapq.heappop, self.heap)
+
+    def compact(self, keep):
+        self.heap[:] = [entry for entry in self.heap if keep(entry)]  # in place, as push and pop are bound to it
+        heapq.heapify(self.heap)
+
+    def __len__(self):
+        return len(self.heap)
+
+
+class CalendarQueue:
+    """A calendar queue (R. Brown, CACM 1988): O(1) amortized operations when bucket widths fit the event times.
+
+    Like the days of a year in a desk calendar, there are n_buckets buckets of `width` time units each, and an event
+    at time t goes to bucket int(t / width) % n_buckets, kept sorted. Events are popped by scanning the buckets from
+    the current one, taking only events of the current "year". When the number of events grows above twice the
+    buckets, or falls below half of them, the buckets are doubled or halved, and their width is recomputed from the
+    separation between the earliest events.
+    """
+
+    sample_size = 25  # events used to estimate the bucket width on resizes
+
+    def __init__(self, n_buckets=2, width=1.0):
+        self.size = 0
+        self.now = 0.0  # time of the last popped event: new events can't be earlier than this
+        self.setup(n_buckets, width, 0.0)
+
+    def setup(self, n_buckets, width, start):
+        self.buckets = [[] for _ in range(n_buckets)]
+        self.width = width
+        self.day = int(start / width)  # number of the current bucket, counting from time 0 (not modulo n_buckets)
+        self.shrink_at = n_buckets // 2 - 2
+        self.grow_at = 2 * n_buckets
+
+    def push(self, entry):
+        buckets = self.buckets
+        bisect.insort(buckets[int(entry[0] / self.width) % len(buckets)], entry)
+        self.size += 1
+        if self.size > self.grow_at:
+            self.resize(2 * len(buckets))
+
+    def pop(self):
+        if not self.size:
+            raise IndexError("pop from an empty event queue")
+        buckets, width = self.buckets, self.width
+        n_buckets = len(buckets)
+        day = self.day
+        for _ in range(n_buckets):
+            bucket = buckets[day % n_buckets]
+            if bucket and int(bucket[0][0] / width) <= day:  # the same computation as in push, so no rounding issues
+                self.day = day
+                return self.popped(bucket)
+            day += 1
+        # no event in the next year: jump directly to the earliest event
+        bucket = min((bucket for bucket in buckets if bucket), key=lambda bucket: bucket[0][0])
+        self.day = int(bucket[0][0] / width)
+        return self.popped(bucket)
+
+    def popped(self, bucket):
+        entry = bucket.pop(0)  # buckets are short, this is cheap
+        self.now = entry[0]
+        self.size -= 1
+        if self.size < self.shrink_at:
+            self.resize(len(self.buckets) // 2)
+        return entry
+
+    def resize(self, n_buckets):
+        entries = sorted(chain.from_iterable(self.buckets))
+        times = [entry[0] for entry in entries[:self.sample_size]]
+        width = self.width
+        gaps = [b - a for a, b in zip(times, times[1:])]
+        if gaps and sum(gaps) > 0:
+            mean = sum(gaps) / len(gaps)
+            small_gaps = [gap for gap in gaps if gap <= 2 * mean]  # ignore outliers
+            width = 3 * sum(small_gaps) / len(small_gaps) or width
+        self.setup(max(n_buckets, 2), width, self.now)
+        buckets = self.buckets
+        for entry in entries:
+            buckets[int(entry[0] / width) % len(buckets)].append(entry)  # entries are sorted, so buckets are too
+
+    def compact(self, keep):
+        for bucket in self.buckets:
+            bucket[:] = [entry for entry in bucket if keep(entry)]
+        self.size = sum(map(len, self.buckets))
+        if self.size < self.shrink_at:
+            self.resize(len(self.buckets) // 2)
+
+    def __len__(self):
+        return self.size
+
+
+class Rung:
+    """A rung of a LadderQueue: unsorted buckets of equal width, covering times from start onwards."""
+
+    def __init__(self, start, width, n_buckets):
+        self.start = start
+        self.width = width
+        self.buckets = [[] for _ in range(n_buckets)]
+        self.current = 0  # buckets before this one were already moved further down the ladder
+
+    def current_start(self):
+        return self.start + self.current * self.width
+
+    def add(self, entry):
+        buckets = self.buckets
+        i = int((entry[0] - self.start) / self.width)
+        buckets[min(max(i, self.current), len(buckets) - 1)].append(entry)  # clamped against rounding errors
+
+
+class LadderQueue:
+    """A ladder queue (W. T. Tang, R. S. M. Goh, I. L.-J. Thng, ACM TOMACS 2005): O(1) amortized operations, also
+    when the distribution of event times is skewed or changes over time.
+
+    Events far in the future are appended, unsorted, to `top`. When `bottom` (a heap of the earliest events) runs
+    out, the events of top are spread in the buckets of a rung; the first non-empty bucket is moved to bottom if it
+    has at most `threshold` events, or spread in turn in a finer rung below. New events go to the first level whose
+    time range includes them.
+    """
+
+    threshold = 50  # maximum events sorted at once in bottom
+    max_rungs = 8
+
+    def __init__(self):
+        self.top = []
+        self.top_start = 0.0  # events from this time on go to top
+        self.top_min = self.top_max = None
+        self.rungs = []
+        self.bottom = []
+        self.size = 0
+
+    def push(self, entry):
+        self.size += 1
+        t = entry[0]
+        if t >= self.top_start:
+            self.top.append(entry)
+            if self.top_min is None or t < self.top_min:
+                self.top_min = t
+            if self.top_max is None or t > self.top_max:
+                self.top_max = t
+            return
+        for rung in self.rungs:
+            if t >= rung.current_start():
+                rung.add(entry)
+                return
+        heapq.heappush(self.bottom, entry)
+
+    def pop(self):
+        if not self.bottom:
+            self.refill()
+        self.size -= 1
+        return heapq.heappop(self.bottom)
+
+    def spawn_rung(self, start, width, entries):
+        rung = Rung(start, width, len(entries) + 1)
+        for entry in entries:
+            rung.add(entry)
+        self.rungs.append(rung)
+
+    def refill(self):
+        """Move the earliest events to bottom, going down the ladder (and creating rungs) as needed."""
+        while True:
+            if not self.rungs:
+                if not self.top:
+                    raise IndexError("pop from an empty event queue")
+                entries, self.top = self.top, []
+                start = self.top_min
+                width = (self.top_max - start) / len(entries)
+                # the end of the new rung; if all the events have the same time, just after it, so that events pushed
+                # later at that time go to bottom too and are ordered with them by priority and sequence number
+                self.top_start = self.top_max + width if width else math.nextafter(self.top_max, math.inf)
+                self.top_min = self.top_max = None
+                if width == 0 or len(entries) <= self.threshold:
+                    self.bottom = entries
+                    heapq.heapify(entries)
+                    return
+                self.spawn_rung(start, width, entries)
+                continue
+            rung = self.rungs[-1]
+            buckets = rung.buckets
+            while rung.current < len(buckets) and not buckets[rung.current]:
+                rung.current += 1
+            if rung.current == len(buckets):
+                self.rungs.pop()
+                continue
+            bucket_start = rung.current_start()
+            entries = buckets[rung.current]
+            buckets[rung.current] = []
+            rung.current += 1
+            if len(entries) <= self.threshold or len(self.rungs) == self.max_rungs:
+                self.bottom = entries
+                heapq.heapify(entries)
+                return
+            width = rung.width / len(entries)
+            if bucket_start + width == bucket_start:  # too close in time to be split further
+                self.bottom = entries
+                heapq.heapify(entries)
+                return
+            self.spawn_rung(bucket_start, width, entries)
+
+    def compact(self, keep):
+        self.top = [entry for entry in self.top if keep(entry)]
+        times = [entry[0] for entry in self.top]
+        self.top_min, self.top_max = (min(times), max(times)) if times else (None, None)
+        for rung in self.rungs:
+            for bucket in rung.buckets:
+                bucket[:] = [entry for entry in bucket if keep(entry)]
+        self.bottom = [entry for entry in self.bottom if keep(entry)]
+        heapq.heapify(self.bottom)
+        self.size = len(self.top) + len(self.bottom) + sum(len(bucket) for rung in self.rungs for bucket in rung.buckets)
+
+    def __len__(self):
+        return self.size
+
+
+EVENT_QUEUES = {'heap': HeapQueue, 'calendar': CalendarQueue, 'ladder': LadderQueue}
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+import argparse
+import configparser
+import heapq
+import multiprocessing
+import os
+import queue
+import random
+import sys
+import time
+from itertools import count
+
+from discrete_event_sim import EVENT_QUEUES
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RESULT_POLL_INTERVAL = 1.0  # seconds between checks that the process of run_in_process is still alive
+
+
+def count_events(sim):
+    """Events popped from the queue of sim, and those still pending, computed from sequence numbers after a run.
+
+    Wrapping the event queue to count would slow down the run we're measuring.
+    """
+    pending = len(sim.events)
+    return {'events': sim.next_sequence() - pending, 'pending': pending}
+
+
+def check_event_queue(name, operations, seed):
+    """Run random operations on the event queue called name and on a heapq list; return whether they agree.
+
+    Many entries have the same time, and a third of them are pushed at the time of the last popped entry, as events
+    scheduled with delay 0; priorities are random, so that ties are broken by them and by sequence numbers. Some
+    compactions drop random entries. Every pop and len() are compared.
+    """
+    rng = random.Random(seed)
+    events, reference = EVENT_QUEUES[name](), []
+    sequence = count()
+    now = 0
+    for _ in range(operations):
+        action = rng.random()
+        if action < 0.55 or not reference:
+            delay = 0 if rng.random() < 1 / 3 else rng.choice([rng.randrange(10), rng.expovariate(0.1)])
+            entry = (now + delay, rng.choice([-1, 0, 1]), next(sequence))
+            events.push(entry)
+            heapq.heappush(reference, entry)
+        elif action < 0.995:
+            entry = heapq.heappop(reference)
+            if events.pop() != entry:
+                return False
+            now = entry[0]
+        else:
+            dropped = set(rng.sample(reference, len(reference) // 3))
+            events.compact(lambda entry: entry not in dropped)
+            reference = [entry for entry in reference if entry not in dropped]
+            heapq.heapify(reference)
+        if len(events) != len(reference):
+            return False
+    while reference:
+        if events.pop() != heapq.heappop(reference):
+            return False
+    return not len(events)
+
+
+def run_queues(args, event_queue):
+    sys.path.insert(0, os.path.join(HERE, 'queue_sim'))
+    from queue_sim import Queues
+
+    sim = Queues(args.lambd, 1, args.servers, 2, args.max_t / 10, False, 1, event_queue)
+    start = time.perf_counter()
+    sim.run(args.max_t)
+    elapsed = time.perf_counter() - start
+    counts = count_events(sim)
+    completions = sim.completions
+    result = sum(completions[job] - sim.arrivals[job] for job in completions) / len(completions)
+    return elapsed, counts, result
+
+
+def run_backup(args, event_queue):
+    sys.path.insert(0, os.path.join(HERE, 'p2p_backup'))
+    from humanfriendly import parse_size, parse_timespan
+    from storage import Backup, Node
+
+    parsing_functions = [  # as in storage.main
+        ('n', int), ('k', int),
+        ('data_size', parse_size), ('storage_size', parse_size),
+        ('upload_speed', parse_size), ('download_speed', parse_size),
+        ('average_uptime', parse_timespan), ('average_downtime', parse_timespan),
+        ('average_lifetime', parse_timespan), ('average_recover_time', parse_timespan),
+        ('arrival_time', parse_timespan)
+    ]
+    config = configparser.ConfigParser()
+    config.read(os.path.join(HERE, 'p2p_backup', 'basic-config', 'p2p_v1.cfg'))
+    peer = config['peer']
+    cfg = [parse(peer[name]) for name, parse in parsing_functions]
+    nodes = [Node(f"peer-{i}", *cfg) for i in range(args.peers)]
+    sim = Backup(nodes, event_queue)
+    start = time.perf_counter()
+    sim.run(parse_timespan(args.backup_max_t))
+    elapsed = time.perf_counter() - start
+    counts = count_events(sim)
+    return elapsed, counts, sorted(sim.data.items())
+
+
+MODELS = {'Queues': run_queues, 'Backup': run_backup}
+
+
+def run(model, event_queue, args, result_queue):
+    """Run a model in this (fresh) process, so that runs don't affect each other (e.g., through memory usage)."""
+    random.seed(args.seed)
+    result_queue.put(MODELS[model](args, event_queue))
+
+
+class RunFailed(Exception):
+    pass
+
+
+def run_in_process(target, args):
+    """Call target(*args, result_queue) in a separate process, and return what it puts in result_queue.
+
+    If the process exits without a result (e.g., target raised), raise RunFailed rather than waiting forever.
+    """
+    result_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=target, args=(*args, result_queue))
+    process.start()
+    while True:
+        exited = process.exitcode is not None  # checked first: a result put before exiting is then in the queue
+        try:
+            result = result_queue.get(timeout=RESULT_POLL_INTERVAL)
+            break
+        except queue.Empty:
+            if exited:
+                raise RunFailed(f"exited with code {process.exitcode}") from None
+    process.join()
+    return result
+
+
+def main():
+    """Run each model with each event queue, checking that results are the same."""
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--models', nargs='+', choices=MODELS, default=list(MODELS))
+    parser.add_argument('--event-queues', nargs='+', choices=EVENT_QUEUES, default=list(EVENT_QUEUES))
+    parser.add_argument('--servers', type=int, default=100_000, help="servers in Queues (pending events grow with them)")
+    parser.add_argument('--lambd', type=float, default=0.9, help="arrival rate in Queues")
+    parser.add_argument('--max-t', type=float, default=3, help="simulated time for Queues")
+    parser.add_argument('--peers', type=int, default=200, help="peers in Backup (configured as in p2p_v1.cfg)")
+    parser.add_argument('--backup-max-t', default="2 years", help="simulated time for Backup")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--check-operations', type=int, default=100_000,
+                        help="random operations checked on each event queue against heapq before the benchmarks")
+    args = parser.parse_args()
+
+    failures = 0
+    for event_queue in args.event_queues:
+        same = check_event_queue(event_queue, args.check_operations, args.seed)
+        print(f"{event_queue:>9}: same entries as heapq on {args.check_operations:,} random operations: {same}")
+        failures += not same
+    for model in args.models:
+        reference = None
+        for event_queue in args.event_queues:
+            try:
+                elapsed, counts, result = run_in_process(run, (model, event_queue, args))
+            except RunFailed as e:
+                print(f"{model:>7} {event_queue:>9}: FAILED ({e})")
+                failures += 1
+                continue
+            if reference is None:
+                reference, reference_queue = result, event_queue
+            print(f"{model:>7} {event_queue:>9}: {elapsed:7.2f}s, {counts['events']:9,} events "
+                  f"({counts['events'] / elapsed:9,.0f}/s), {counts['pending']:7,} pending at the end, "
+                  f"same result as {reference_queue}: {result == reference}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,7 +4,9 @@ import argparse
 import configparser
 import csv
 import logging
+import os
 import random
+import sys
 from dataclasses import dataclass
 from random import expovariate
 from typing import Optional, List
@@ -14,7 +16,8 @@ from typing import Optional, List
 # then you'll need to handle sizes in bytes and time spans in seconds--or write your own alternative.
 # It should be trivial to install (e.g., apt install python3-humanfriendly or conda/pip install humanfriendly).
 from humanfriendly import format_timespan, parse_size, parse_timespan
-from discrete_event_sim import Simulation, Event
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # see discrete_event_sim/__init__.py
+from discrete_event_sim import EVENT_QUEUES, ScheduledEvent, Simulation, Event
 import subprocess
 
     
@@ -35,8 +38,8 @@ class Backup(Simulation):
 
     # type annotations for `Node` are strings here to allow a forward declaration:
     # https://stackoverflow.com/questions/36193540/self-reference-or-forward-reference-of-type-annotations-in-python
-    def __init__(self, nodes: List['Node']):
-        super().__init__()  # call the __init__ method of parent class
+    def __init__(self, nodes: List['Node'], event_queue='heap'):
+        super().__init__(event_queue)  # call the __init__ method of parent class
         self.nodes = nodes
         self.data = {} 
         self.schedule(0, Monitoring())
@@ -64,8 +67,8 @@ class Backup(Simulation):
             event = BlockRestoreComplete(uploader, downloader, block_id)
         else:
             event = BlockBackupComplete(uploader, downloader, block_id)
-        self.schedule(delay, event)
-        uploader.current_upload = downloader.current_download = event
+        # keep the handle returned by schedule, to cancel the transfer if either node disconnects
+        uploader.current_upload = downloader.current_download = self.schedule(delay, event)
 
         # self.log_info(f"scheduled {event.__class__.__name__} from {uploader} to {downloader}"
         #               f" in {format_timespan(delay)}")
@@ -77,6 +80,7 @@ class Backup(Simulation):
         
 
 class Monitoring(Event):
+    __slots__ = ()
     
     def process(self, sim: Backup):
         available_nodes = sum(
@@ -147,9 +151,9 @@ class Node:
         # (owner -> block_id) mapping for remote blocks stored
         self.remote_blocks_held: dict[Node, int] = {}
 
-        # current uploads and downloads, stored as a reference to the relative TransferComplete event
-        self.current_upload: Optional[TransferComplete] = None
-        self.current_download: Optional[TransferComplete] = None
+        # current uploads and downloads, stored as the handle of the scheduled TransferComplete event
+        self.current_upload: Optional[ScheduledEvent] = None
+        self.current_download: Optional[ScheduledEvent] = None
 
     def find_block_to_back_up(self):
         """Returns the block id of a block that needs backing up, or None if there are none."""
@@ -233,7 +237,7 @@ class Node:
         return self.name
 
 
-@dataclass
+@dataclass(slots=True)
 class NodeEvent(Event):
     """An event regarding a node. Carries the identifier, i.e., the node's index in `Backup.nodes_config`"""
 
@@ -247,6 +251,8 @@ class NodeEvent(Event):
 class Online(NodeEvent):
     """A node goes online."""
 
+    __slots__ = ()
+
     def process(self, sim: Backup):
         node = self.node
         if node.online or node.failed:
@@ -265,6 +271,8 @@ class Online(NodeEvent):
 class Recover(Online):
     """A node goes online after recovering from a failure."""
 
+    __slots__ = ()
+
     def process(self, sim: Backup):
         node = self.node
         sim.log_info(f"{node} recovers")
@@ -276,6 +284,8 @@ class Recover(Online):
 class Disconnection(NodeEvent):
     """Base class for both Offline and Fail, events that make a node disconnect."""
 
+    __slots__ = ()
+
     def process(self, sim: Simulation):
         """Must be implemented by subclasses."""
         raise NotImplementedError
@@ -287,18 +297,20 @@ class Disconnection(NodeEvent):
         # retrieve the nodes we're uploading and downloading to and set their current downloads and uploads to None
         current_upload, current_download = node.current_upload, node.current_download
         if current_upload is not None:
-            current_upload.canceled = True
-            current_upload.downloader.current_download = None
+            current_upload.cancel()
+            current_upload.event.downloader.current_download = None
             node.current_upload = None
         if current_download is not None:
-            current_download.canceled = True
-            current_download.uploader.current_upload = None
+            current_download.cancel()
+            current_download.event.uploader.current_upload = None
             node.current_download = None
 
 
 class Offline(Disconnection):
     """A node goes offline."""
 
+    __slots__ = ()
+
     def process(self, sim: Backup):
         node = self.node
         if node.failed or not node.online:
@@ -312,6 +324,8 @@ class Offline(Disconnection):
 class Fail(Disconnection):
     """A node fails and loses all local data."""
 
+    __slots__ = ()
+
     def process(self, sim: Backup):
         sim.log_info(f"{self.node} fails")
         self.disconnect()
@@ -330,22 +344,19 @@ class Fail(Disconnection):
         sim.schedule(recover_time, Recover(node))
 
 
-@dataclass
+@dataclass(slots=True)
 class TransferComplete(Event):
     """An upload is completed."""
 
     uploader: Node
     downloader: Node
     block_id: int
-    canceled: bool = False
 
     def __post_init__(self):
         assert self.uploader is not self.downloader
 
     def process(self, sim: Backup):
         sim.log_info(f"{self.__class__.__name__} from {self.uploader} to {self.downloader}")
-        if self.canceled:
-            return  # this transfer was canceled, so ignore this event
         uploader, downloader = self.uploader, self.downloader
         assert uploader.online and downloader.online
         self.update_block_state()
@@ -363,6 +374,7 @@ class TransferComplete(Event):
 
 
 class BlockBackupComplete(TransferComplete):
+    __slots__ = ()
 
     def update_block_state(self):
         owner, peer = self.uploader, self.downloader
@@ -373,6 +385,7 @@ class BlockBackupComplete(TransferComplete):
 
 
 class BlockRestoreComplete(TransferComplete):
+    __slots__ = ()
     
     def update_block_state(self):
         owner = self.downloader
@@ -388,6 +401,9 @@ def main():
     parser.add_argument("--max-t", default="100 years")
     parser.add_argument("--seed", help="random seed")
     parser.add_argument("--verbose", action='store_true')
+    parser.add_argument('--event-queue', choices=EVENT_QUEUES, default='heap', help="event queue implementation")
+    parser.add_argument('--profile', action='store_true', help="print statistics about the processed events")
+    parser.add_argument('--profile-json', help="JSON file in which to store statistics about the processed events")
     args = parser.parse_args()
 
     if args.seed:
@@ -420,8 +436,13 @@ def main():
         cfg = [parse(class_config[name]) for name, parse in parsing_functions]
         # the `callable(p1, p2, *args)` idiom is equivalent to `callable(p1, p2, args[0], args[1], ...)
         nodes.extend(Node(f"{node_class}-{i}", *cfg) for i in range(class_config.getint('number')))
-    sim = Backup(nodes)
+    sim = Backup(nodes, args.event_queue)
+    sim.profile = args.profile or args.profile_json is not None
     sim.run(parse_timespan(args.max_t))
+    if args.profile:
+        print(sim.stats.table())
+    if args.profile_json is not None:
+        sim.stats.dump(args.profile_json)
     sim.log_info(f"Simulation over")
     
     
@@ -5,9 +5,12 @@ import argparse
 import csv
 import collections
 import logging
+import os
+import sys
 from random import expovariate, sample, seed
 
-from discrete_event_sim import Simulation, Event
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # see discrete_event_sim/__init__.py
+from discrete_event_sim import EVENT_QUEUES, Simulation, Event
 
 from workloads import weibull_generator
 
@@ -36,8 +39,8 @@ class Queues(Simulation):
     the shortest one.
     """
 
-    def __init__(self, lambd, mu, n, d,monitoring_interval,weibull,shape):
-        super().__init__()
+    def __init__(self, lambd, mu, n, d,monitoring_interval,weibull,shape, event_queue='heap'):
+        super().__init__(event_queue)
         self.running = [None] * n  # if not None, the id of the running job (per queue)
         self.queues = [collections.deque() for _ in range(n)]  # FIFO queues of the system
         # NOTE: we don't keep the running jobs in self.queues
@@ -91,6 +94,8 @@ class Queues(Simulation):
 class Arrival(Event):
     """Event representing the arrival of a new job."""
 
+    __slots__ = ('id',)
+
     def __init__(self, job_id):
         self.id = job_id
 
@@ -121,6 +126,8 @@ class Arrival(Event):
 class Completion(Event):
     """Job completion."""
 
+    __slots__ = ('job_id', 'queue_index')
+
     def __init__(self, job_id, queue_index):
         self.job_id = job_id  # currently unused, might be useful when extending
         self.queue_index = queue_index
@@ -139,6 +146,9 @@ class Completion(Event):
 
 class Monitoring(Event):
     """Event for periodic monitoring of queue lengths."""
+
+    __slots__ = ()
+
     def process(self, sim: Queues):
         # Record the current queue lengths
         queue_lengths = [sim.queue_len(i) for i in range(sim.n)]
@@ -171,6 +181,9 @@ def main():
     parser.add_argument('--weibull', action=argparse.BooleanOptionalAction, default=True, help="use weibull distribution")
     parser.add_argument("--seed", help="random seed")
     parser.add_argument("--verbose", action='store_true')
+    parser.add_argument('--event-queue', choices=EVENT_QUEUES, default='heap', help="event queue implementation")
+    parser.add_argument('--profile', action='store_true', help="print statistics about the processed events")
+    parser.add_argument('--profile-json', help="JSON file in which to store statistics about the processed events")
     parser.add_argument('--avgtable', action=argparse.BooleanOptionalAction, default=False, help="generate csv for avg-time table")
     
     args = parser.parse_args()
@@ -193,8 +206,13 @@ def main():
         logging.warning("The system is unstable: lambda >= mu")
 
     monitor_delay = (args.max_t*0.001)/(args.n*args.lambd)
-    sim = Queues(args.lambd, args.mu, args.n, args.d, monitor_delay, args.weibull,args.shape)
+    sim = Queues(args.lambd, args.mu, args.n, args.d, monitor_delay, args.weibull,args.shape, args.event_queue)
+    sim.profile = args.profile or args.profile_json is not None
     sim.run(args.max_t)
+    if args.profile:
+        print(sim.stats.table())
+    if args.profile_json is not None:
+        sim.stats.dump(args.profile_json)
 
     completions = sim.completions
     W = ((sum(completions.values()) - sum(sim.arrivals[job_id] for job_id in completions))
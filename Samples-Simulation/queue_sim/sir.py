@@ -4,10 +4,13 @@ import argparse
 import collections
 import enum
 import logging
+import os
 import random
+import sys
 
 from matplotlib import pyplot as plt
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # see discrete_event_sim/__init__.py
 from discrete_event_sim import Simulation, Event
 
 
@@ -58,6 +61,8 @@ class SIR(Simulation):
 class Contact(Event):
     """A possible contagion event."""
 
+    __slots__ = ('source', 'destination')
+
     def __init__(self, source, destination):
         """Parameters: indexes of both the source and the destination of the possible contagion."""
 
@@ -78,6 +83,8 @@ class Contact(Event):
 class Recover(Event):
     """A sick patient recovers."""
 
+    __slots__ = ('patient',)
+
     def __init__(self, patient):
         self.patient = patient
 
@@ -89,6 +96,8 @@ class Recover(Event):
 class MonitorSIR(Event):
     """At any configurable interval, we save the number of susceptible, infected and recovered individuals."""
 
+    __slots__ = ('interval',)
+
     def __init__(self, interval=1):
         self.interval = interval
 
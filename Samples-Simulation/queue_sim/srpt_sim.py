@@ -6,9 +6,12 @@ import csv
 import collections
 import logging
 import heapq
+import os
+import sys
 from random import expovariate, sample, seed
 
-from discrete_event_sim_srpt import Simulation, Event
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # see discrete_event_sim/__init__.py
+from discrete_event_sim import Simulation, Event
 
 from workloads import weibull_generator
 
@@ -80,6 +83,8 @@ class Queues(Simulation):
 class Arrival(Event):
     """Event representing the arrival of a new job."""
 
+    __slots__ = ('job',)
+
     def __init__(self, job_id,sim: Queues):
         remaining_time = sim.service_gen() if sim.useWeibull else expovariate(sim.mu)
         self.job = Job(job_id,remaining_time)
@@ -101,6 +106,8 @@ class Arrival(Event):
 class Completion(Event):
     """Job completion."""
 
+    __slots__ = ('job', 'queue_index')
+
     def __init__(self, job, queue_index):
         self.job = job  
         self.queue_index = queue_index
@@ -122,6 +129,9 @@ class Completion(Event):
 
 class Monitoring(Event):
     """Event for periodic monitoring of queue lengths."""
+
+    __slots__ = ()
+
     def process(self, sim: Queues):
         # Record the current queue lengths
         queue_lengths = [sim.queue_len(i) for i in range(sim.n)]